@@ -0,0 +1,6 @@
+# shared planning and execution for the OT-2 transfection protocol; each experiment script only holds its csv and settings
+from .liquids import LiquidClass, default_liquid_classes
+from .plan import Settings, build_plan, legacy_reagent_positions
+from .protocol import lazy_plan, plan_run, plan_with_changes, prepare, run
+
+__all__ = ['LiquidClass', 'Settings', 'build_plan', 'default_liquid_classes', 'lazy_plan', 'legacy_reagent_positions', 'plan_run', 'plan_with_changes', 'prepare', 'run']
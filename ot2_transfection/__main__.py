@@ -0,0 +1,6 @@
+# python -m ot2_transfection ... (see cli.py)
+import sys
+
+from .cli import main
+
+sys.exit(main())
@@ -0,0 +1,148 @@
+# timing calibration - fits the run time estimate's figures (see timing.py) to traces of real runs by least squares, and keeps
+# the fit in timing_model_file, where every estimate picks it up; traces already fitted are skipped, so new runs can be added
+# as they come in
+#   python -m ot2_transfection calibrate /data/traces/
+import hashlib
+import json
+import math
+import os
+
+from .timing import Estimator, default_timing, timing_model_file
+
+# the figures fitted; travel is sec per mm, the inverse of gantry_speed
+fitted = ['move', 'travel', 'pick_up_tip', 'drop_tip', 'blow_out', 'touch_tip', 'plunger', 'flow_scale', 'mix_cycle']
+prior_weight = 1.0 # pulls each figure towards its default, so figures the traces say nothing about (e.g. touch_tip) keep it
+
+
+def figures_timing(figures):
+    timing = {name: value for name, value in figures.items() if name != 'travel'}
+    timing['gantry_speed'] = 1 / figures['travel']
+    return timing
+
+
+def default_figures():
+    figures = {name: default_timing[name] for name in fitted if name != 'travel'}
+    figures['travel'] = 1 / default_timing['gantry_speed']
+    return figures
+
+
+# a command's estimated seconds are linear in the fitted figures: an estimator with all of them at 0 gives the part that doesn't
+# depend on them (liquid class delays), and one per figure with just that figure at 1 gives its term
+class CommandFeatures:
+    def __init__(self, deck):
+        zero = dict({name: 0 for name in fitted if name != 'travel'}, gantry_speed=float('inf'))
+        self.base = Estimator(deck, zero)
+        self.units = [Estimator(deck, dict(zero, **({'gantry_speed': 1} if name == 'travel' else {name: 1}))) for name in fitted]
+
+    # (seconds that don't depend on the figures, [term per figure]); every command goes through, so positions and flow rates follow the run
+    def command(self, command):
+        base = self.base.command(command)
+        return base, [round(estimator.command(command) - base, 6) for estimator in self.units]
+
+
+def new_model():
+    size = len(fitted)
+    return {'figures': default_figures(), 'timing': {}, 'XtX': [[0.0] * size for _ in range(size)], 'Xty': [0.0] * size, 'yty': 0.0, 'commands': 0, 'traces': []}
+
+
+def load_model(path):
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return new_model()
+
+
+# timed commands of a real run's trace (trace.py): (terms, seconds less the part that doesn't depend on the figures)
+def trace_rows(trace):
+    for event in trace['traceEvents']:
+        args = event.get('args', {})
+        if event.get('cat') == 'command' and 'features' in args:
+            yield args['features'], event['dur'] / 1e6 - args['base_seconds']
+
+
+# add a trace's commands to the model's sums; False if the model already has it
+def add_trace(model, text):
+    digest = hashlib.sha256(text.encode()).hexdigest()[:16]
+    if digest in model['traces']:
+        return False
+    for features, seconds in trace_rows(json.loads(text)):
+        for i, feature in enumerate(features):
+            model['Xty'][i] += feature * seconds
+            for j, other in enumerate(features):
+                model['XtX'][i][j] += feature * other
+        model['yty'] += seconds * seconds
+        model['commands'] += 1
+    model['traces'].append(digest)
+    return True
+
+
+# solve a x = b by Gaussian elimination with partial pivoting
+def solve(a, b):
+    size = len(b)
+    rows = [list(a[i]) + [b[i]] for i in range(size)]
+    for column in range(size):
+        pivot = max(range(column, size), key=lambda row: abs(rows[row][column]))
+        rows[column], rows[pivot] = rows[pivot], rows[column]
+        for row in range(column + 1, size):
+            factor = rows[row][column] / rows[column][column]
+            for k in range(column, size + 1):
+                rows[row][k] -= factor * rows[column][k]
+    x = [0.0] * size
+    for row in reversed(range(size)):
+        x[row] = (rows[row][size] - sum(rows[row][k] * x[k] for k in range(row + 1, size))) / rows[row][row]
+    return x
+
+
+# least squares fit of the figures, pulled towards the defaults by prior_weight; no figure goes below 0
+def fit(model):
+    prior = default_figures()
+    a = [[model['XtX'][i][j] + (prior_weight if i == j else 0) for j in range(len(fitted))] for i in range(len(fitted))]
+    b = [model['Xty'][i] + prior_weight * prior[name] for i, name in enumerate(fitted)]
+    figures = dict(zip(fitted, solve(a, b)))
+    for name, value in figures.items():
+        if value < 0 or (name == 'travel' and value == 0):
+            figures[name] = prior[name] if name == 'travel' else 0
+    model['figures'] = figures
+    model['timing'] = figures_timing(figures)
+    return model
+
+
+# root mean square error per command of the figures over the traces in the model
+def rms_error(model, figures):
+    x = [figures[name] for name in fitted]
+    size = len(fitted)
+    squares = model['yty'] - 2 * sum(x[i] * model['Xty'][i] for i in range(size)) + sum(x[i] * model['XtX'][i][j] * x[j] for i in range(size) for j in range(size))
+    return math.sqrt(max(squares, 0) / model['commands']) if model['commands'] else 0
+
+
+def trace_paths(paths):
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            found += sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith('.json'))
+        else:
+            found.append(path)
+    return found
+
+
+# add new traces to the model at path and fit it again; returns the model and how many traces were new
+def calibrate(paths, path=None, reset=False):
+    path = path or timing_model_file
+    model = new_model() if reset else load_model(path)
+    added = 0
+    for trace_path in trace_paths(paths):
+        with open(trace_path) as f:
+            added += add_trace(model, f.read())
+    fit(model)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(model, f, indent=1)
+    return model, added
+
+
+def print_calibration(model, added, path):
+    print(str(added) + ' new trace(s), ' + str(len(model['traces'])) + ' in total, ' + str(model['commands']) + ' timed commands; model saved to ' + path)
+    prior = default_figures()
+    for name in fitted:
+        print('  ' + name.ljust(12) + str(round(prior[name], 4)).rjust(8) + ' -> ' + str(round(model['figures'][name], 4)))
+    print('  rms error per command: ' + str(round(rms_error(model, prior), 2)) + ' s with the defaults, ' + str(round(rms_error(model, model['figures']), 2)) + ' s fitted')
@@ -0,0 +1,240 @@
+# plan-only command line: plan plate maps without a robot and report what the run would do, as JSON or a table
+#   python -m ot2_transfection plan maps/ --format table --set Excess=1.3
+import argparse
+import dataclasses
+import importlib.util
+import json
+import os
+import pathlib
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from .calibrate import calibrate, print_calibration
+from .diff import diff_paths, print_diff
+from .ledger import ledger_trends, print_trends
+from .plan import Settings
+from .protocol import plan_run
+from .report import plan_summary
+from .service import serve
+from .sweep import run_sweep, print_ranking, default_prices
+from .timing import timing_model_file
+from .trace import estimated_trace
+
+
+# plate maps in the given files and directories: .csv files hold just the csv, .py files are protocol scripts whose csv_raw and settings are used
+def plate_map_paths(paths):
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            found += sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith(('.csv', '.py')))
+        else:
+            found.append(path)
+    return found
+
+
+# the csv and settings for one plate map: a script's csv text, or the pathlib.Path of a .csv file, which build_plan() reads as it plans;
+# overrides are Settings fields from the command line
+def load_plate_map(path, overrides):
+    if path.endswith('.py'):
+        # scripts plan lazily, so loading one only reads its csv and settings (it does need opentrons to be importable)
+        spec = importlib.util.spec_from_file_location('plate_map', path)
+        script = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(script)
+        settings = dataclasses.replace(getattr(script, 'settings', None) or Settings(), **overrides)
+        return script.csv_raw, settings
+    return pathlib.Path(path), Settings(**overrides)
+
+
+# everything a plan-only run reports for one plate map
+def plan_report(path, overrides):
+    report = {'file': path, 'errors': [], 'warnings': []}
+    try:
+        csv_raw, settings = load_plate_map(path, overrides)
+        plan = plan_run(csv_raw, settings)
+    except Exception as error:
+        report['errors'].append('could not plan ' + path + ': ' + type(error).__name__ + ': ' + str(error))
+        return report
+    return plan_summary(plan, report)
+
+
+def plan_reports(paths, overrides, jobs):
+    if jobs == 1 or len(paths) == 1:
+        return [plan_report(path, overrides) for path in paths]
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        return list(pool.map(plan_report, paths, [overrides] * len(paths), chunksize=8))
+
+
+def print_table(reports):
+    columns = [('plate map', 40), ('status', 8), ('transfers', 10), ('p300 tips', 10), ('p20 tips', 9), ('OM MM uL', 10), ('P3K MM uL', 10), ('L3K MM uL', 10), ('est. min', 9)]
+    print(''.join(name.ljust(width) for name, width in columns))
+    for report in reports:
+        name = os.path.basename(report['file'])
+        name = name if len(name) < 39 else name[:36] + '...'
+        cells = [name, 'error' if report['errors'] else 'ok']
+        if 'steps' in report:
+            master_mix = report['master_mix']
+            cells += [str(sum(len(transfers) for transfers in report['steps'].values())), str(report['tips'].get('p300', '-')), str(report['tips'].get('p20', '-')),
+                str(master_mix['OM_MM_vol']), str(master_mix['P3K_MM_vol']), str(master_mix['L3K_MM_vol']), str(round(report['estimated_seconds']['total'] / 60, 1))]
+        print(''.join(cell.ljust(width) for cell, (_, width) in zip(cells, columns)))
+    for report in reports:
+        for error in report['errors']:
+            print(os.path.basename(report['file']) + ': Error: ' + error)
+
+
+def sweep(args):
+    with open(args.base) as f:
+        base_csv = f.read()
+    with open(args.grid) as f:
+        grid = json.load(f)
+    results = run_sweep(base_csv, grid, args.jobs)
+    best = [result for result in results if result['fits']][:args.top]
+    if args.out:
+        os.makedirs(args.out, exist_ok=True)
+        for rank, result in enumerate(best, 1):
+            with open(os.path.join(args.out, 'sweep_' + str(rank).zfill(2) + '.csv'), 'w') as f:
+                f.write(result['csv'])
+    if args.format == 'json':
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        print_ranking(results, args.top)
+    return 0 if best else 1
+
+
+def diff(args):
+    report = diff_paths(args.a, args.b, Settings(**dict(args.overrides)))
+    if args.format == 'json':
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        print_diff(report)
+    # gate a revision on its estimated run time, e.g. in CI
+    if args.max_slowdown is not None and report['slowdown'] > args.max_slowdown:
+        print('estimated run time grew by ' + str(report['slowdown']) + ' s, more than the ' + str(args.max_slowdown) + ' s allowed', file=sys.stderr)
+        return 1
+    return 0
+
+
+# the estimated timeline of one plate map, for a trace viewer
+def trace(args):
+    csv_raw, settings = load_plate_map(args.path, dict(args.overrides))
+    plan = plan_run(csv_raw, settings)
+    for error in plan.errors:
+        print('Error: ' + error, file=sys.stderr)
+    if plan.errors:
+        return 1
+    estimated_trace(plan, args.pause_seconds).write(args.out)
+    print('wrote ' + args.out + ' - open it in ui.perfetto.dev or chrome://tracing')
+    return 0
+
+
+# throughput and cost trends from the run ledger
+def ledger(args):
+    if not os.path.exists(args.file):
+        print('no ledger at ' + args.file + '; copy it off the robot (Settings.ledger_file) or point --file at it', file=sys.stderr)
+        return 1
+    trends = ledger_trends(args.file, args.by, args.since, dict(default_prices, **dict(args.prices)))
+    if args.format == 'json':
+        json.dump(trends, sys.stdout, indent=2)
+        print()
+    else:
+        print_trends(trends)
+    return 0
+
+
+# NAME=VALUE from --price
+def parse_price(text):
+    name, _, value = text.partition('=')
+    try:
+        return name, float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError('price must be NAME=number, e.g. L3000=1.2, not ' + repr(text))
+
+
+def calibration(args):
+    model, added = calibrate(args.paths, args.model, args.reset)
+    print_calibration(model, added, args.model)
+    return 0
+
+
+# KEY=VALUE from --set; the value is read as JSON when it can be (numbers, true/false, {...}), otherwise kept as a string
+def parse_override(text):
+    name, _, value = text.partition('=')
+    if name not in Settings.__dataclass_fields__:
+        raise argparse.ArgumentTypeError('unknown setting ' + repr(name) + '; see Settings in ot2_transfection/plan.py')
+    try:
+        return name, json.loads(value)
+    except ValueError:
+        return name, value
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m ot2_transfection', description='Plan transfection plate maps without a robot.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    plan_parser = commands.add_parser('plan', help='plan plate maps and report transfers, volumes, tips, run time and problems')
+    plan_parser.add_argument('paths', nargs='+', help='plate map .csv files, protocol scripts (.py), or directories of them')
+    plan_parser.add_argument('--format', choices=['json', 'table'], default='json')
+    plan_parser.add_argument('--set', dest='overrides', type=parse_override, action='append', default=[], metavar='KEY=VALUE', help='change a Settings field, e.g. --set Excess=1.3')
+    plan_parser.add_argument('--jobs', type=int, default=None, help='worker processes (default: one per CPU)')
+    sweep_parser = commands.add_parser('sweep', help='plan a grid of settings and DNA doses and rank the plans that fit on one deck')
+    sweep_parser.add_argument('base', help='plate map .csv with the DNA sources, concentrations and transfections to lay out')
+    sweep_parser.add_argument('grid', help='JSON file with lists of values for Settings fields, "DNA wanted (ng)" dose series, "replicates" and "prices"')
+    sweep_parser.add_argument('--top', type=int, default=5, help='how many of the best plans to show and write out')
+    sweep_parser.add_argument('--out', help='directory to write the best plate maps to, as sweep_01.csv, ...')
+    sweep_parser.add_argument('--format', choices=['json', 'table'], default='table')
+    sweep_parser.add_argument('--jobs', type=int, default=None, help='worker processes (default: one per CPU)')
+    diff_parser = commands.add_parser('diff', help='compare the commands two protocol scripts or plate maps send to the robot')
+    diff_parser.add_argument('a', help='old protocol script (.py) or plate map (.csv)')
+    diff_parser.add_argument('b', help='new protocol script (.py) or plate map (.csv)')
+    diff_parser.add_argument('--set', dest='overrides', type=parse_override, action='append', default=[], metavar='KEY=VALUE', help='change a Settings field for .csv plate maps')
+    diff_parser.add_argument('--format', choices=['json', 'text'], default='text')
+    diff_parser.add_argument('--max-slowdown', type=float, default=None, metavar='SECONDS', help='exit 1 if b is estimated to run longer than a by more than this')
+    trace_parser = commands.add_parser('trace', help='write the estimated timeline of a run as Chrome trace JSON')
+    trace_parser.add_argument('path', help='plate map .csv or protocol script (.py)')
+    trace_parser.add_argument('--out', default='transfection_trace.json')
+    trace_parser.add_argument('--set', dest='overrides', type=parse_override, action='append', default=[], metavar='KEY=VALUE', help='change a Settings field, e.g. --set Excess=1.3')
+    trace_parser.add_argument('--pause-seconds', type=float, default=0, metavar='SECONDS', help='how long the operator is assumed to take at each pause')
+    calibrate_parser = commands.add_parser('calibrate', help='fit the run time estimate to traces of real runs (Settings.trace_file)')
+    calibrate_parser.add_argument('paths', nargs='+', help='trace .json files from real runs, or directories of them')
+    calibrate_parser.add_argument('--model', default=timing_model_file, help='where the fitted figures are kept and read by every estimate')
+    calibrate_parser.add_argument('--reset', action='store_true', help='start a new fit instead of adding to the one in --model')
+    ledger_parser = commands.add_parser('ledger', help='throughput, tip and reagent cost trends from the history of real runs')
+    ledger_parser.add_argument('--file', default=Settings.ledger_file, help='ledger database (Settings.ledger_file), copied off the robot')
+    ledger_parser.add_argument('--by', choices=['day', 'week', 'month'], default='week')
+    ledger_parser.add_argument('--since', metavar='YYYY-MM-DD', help='only runs started on or after this date')
+    ledger_parser.add_argument('--price', dest='prices', type=parse_price, action='append', default=[], metavar='NAME=VALUE', help='cost per uL of a reagent, e.g. --price L3000=1.2')
+    ledger_parser.add_argument('--format', choices=['json', 'table'], default='table')
+    serve_parser = commands.add_parser('serve', help='plan plate maps for others over HTTP, with a ready-to-upload protocol for each (see service.py)')
+    serve_parser.add_argument('--host', default='127.0.0.1', help='address to listen on; 0.0.0.0 to take plate maps from other machines')
+    serve_parser.add_argument('--port', type=int, default=8470)
+    serve_parser.add_argument('--jobs', type=int, default=None, help='worker processes (default: one per CPU)')
+    serve_parser.add_argument('--cache-size', type=int, default=256, help='how many plans to keep, by plate map and settings')
+    args = parser.parse_args(argv)
+    # a bad --set (e.g. a liquid class with an unknown field) is reported here, not from inside each plan
+    try:
+        Settings(**dict(getattr(args, 'overrides', [])))
+    except TypeError as error:
+        parser.error(str(error))
+    if args.command == 'sweep':
+        return sweep(args)
+    if args.command == 'diff':
+        return diff(args)
+    if args.command == 'trace':
+        return trace(args)
+    if args.command == 'calibrate':
+        return calibration(args)
+    if args.command == 'ledger':
+        return ledger(args)
+    if args.command == 'serve':
+        serve(args.host, args.port, args.jobs, args.cache_size)
+        return 0
+
+    paths = plate_map_paths(args.paths)
+    reports = plan_reports(paths, dict(args.overrides), args.jobs)
+    if args.format == 'json':
+        json.dump(reports, sys.stdout, indent=2)
+        print()
+    else:
+        print_table(reports)
+    # non-zero exit when any plate map can't be run, so CI fails on it
+    return 1 if any(report['errors'] for report in reports) else 0
@@ -0,0 +1,408 @@
+# the command stream - every pipetting action of a run, worked out from the plan before the robot moves
+import math
+from dataclasses import dataclass, field
+
+from .deck import tube, plate_well, pipette_specs, reagent_position, reagent_wells, reagent_load_volumes
+from .liquids import liquid_class
+
+
+steps = ['DNA transfer', 'OM/P3K MM', 'OM/L3K MM', 'complex mixing', 'plate addition']
+
+
+# one pipette.transfer() call
+@dataclass
+class Transfer:
+    step: str
+    label: str
+    pipette: str # 'p300', 'p20' or 'p1000'
+    volume: float
+    source: tuple # (labware, well)
+    dest: tuple
+    mix_before: tuple = (0,0)
+    mix_after: tuple = (0,0)
+    new_tip: str = 'always'
+    line: int = None # csv line the transfer comes from, if any
+    liquid: object = None # LiquidClass it is pipetted with; None to use the pipette's flow rates and blow out, as pipette.transfer() does
+    blow_out: bool = True # False once optimize.py finds the blow out isn't needed; the liquid class can also turn it off
+
+
+# one tip carrying DNA from a source tube to several destinations: each fill is dispensed a little at a time, above the
+# liquid already in the destinations, and the extra taken for accuracy is blown back into the source
+@dataclass
+class Distribute:
+    step: str
+    label: str
+    pipette: str
+    source: tuple
+    dests: list # [(dest, volume), ...] in dispensing order
+    mix_before: tuple = (0,0)
+    disposal: float = 0 # uL aspirated on top of each fill and blown back into the source
+    height: float = 5 # mm above the destination bottom to dispense at
+    liquid: object = None
+    line: int = None # csv line of the first destination
+
+    @property
+    def volume(self):
+        return sum(volume for _, volume in self.dests)
+
+
+# protocol.pause, with the tip racks the operator swaps at the same time
+@dataclass
+class Pause:
+    step: str
+    name: str
+    message: str
+    replace_tips: list = field(default_factory=list)
+    needed: bool = True # False for a reagent pause that minimize_pauses leaves out unless tip racks are swapped at it
+
+
+# protocol.delay, counting from the end of the robot's work before it (time at a pause in between counts towards it)
+@dataclass
+class Delay:
+    step: str
+    name: str
+    message: str
+    seconds: float
+
+
+# pick_up_tip/drop_tip around transfers that reuse one tip
+@dataclass
+class Tip:
+    step: str
+    pipette: str
+    action: str # 'pick_up' or 'drop'
+
+
+# change a flow rate or bottom clearance on a pipette
+@dataclass
+class Setting:
+    step: str
+    pipette: str
+    attribute: str # 'flow_rate.aspirate', 'flow_rate.dispense', 'clearance.aspirate' or 'clearance.dispense'
+    value: float
+
+
+# tips a command picks up
+def tips_used(command):
+    if isinstance(command, Transfer) and command.new_tip == 'always':
+        return max(1, math.ceil(command.volume / pipette_specs[command.pipette]['max_volume']))
+    if isinstance(command, Distribute) or (isinstance(command, Tip) and command.action == 'pick_up'):
+        return 1
+    return 0
+
+
+# (source, dest, uL) for each liquid movement of a command
+def moves(command):
+    if isinstance(command, Transfer):
+        return [(command.source, command.dest, command.volume)]
+    if isinstance(command, Distribute):
+        return [(command.source, dest, volume) for dest, volume in command.dests]
+    return []
+
+
+# fills of a multi-dispense: destinations packed in order into as few tips-full as the pipette holds, leaving room for the disposal volume
+def distribute_fills(command):
+    capacity = pipette_specs[command.pipette]['max_volume'] - command.disposal
+    fills = [[]]
+    for dest, volume in command.dests:
+        if fills[-1] and sum(v for _, v in fills[-1]) + volume > capacity:
+            fills.append([])
+        fills[-1].append((dest, volume))
+    return fills
+
+
+# volumes pipette.transfer() splits a transfer into: full tips while more than two are left, then two equal halves
+def transfer_volumes(volume, max_volume):
+    volumes = []
+    while volume > 2 * max_volume:
+        volumes.append(max_volume)
+        volume -= max_volume
+    if volume > max_volume:
+        volumes += [volume / 2, volume / 2]
+    else:
+        volumes.append(volume)
+    return volumes
+
+
+# tips used per pipette before the first pause, between pauses and after the last one
+def tip_demand(commands):
+    demand = [{pipette: 0 for pipette in pipette_specs}]
+    for command in commands:
+        if isinstance(command, Pause):
+            demand.append({pipette: 0 for pipette in pipette_specs})
+        else:
+            for pipette in pipette_specs:
+                if getattr(command, 'pipette', None) == pipette:
+                    demand[-1][pipette] += tips_used(command)
+    return demand
+
+
+# rough liquid height in mm in a 1.5 mL tube: the conical bottom takes the first 7 mm, then about 2 cm per mL
+def liquid_height(volume):
+    return 7 + volume / 50
+
+
+stroke_margin = 2 # mm the tip stays above the liquid when a stroke dispenses from above it
+highest_dispense = 35 # mm from the bottom of a 1.5 mL tube, just under the rim
+
+
+# mm above the bottom of an entry's destination to dispense at without touching its liquid, once the entry's DNA is in;
+# DNA_in is the uL already in each destination
+def dispense_height(DNA_in, entry):
+    return liquid_height(DNA_in.get(entry.DNA_dest, 0) + entry.uL_DNA) + stroke_margin
+
+
+# the pipette for a volume the protocol would give the p300 (use_p300) or the p20: a p1000 takes what it can do in fewer
+# strokes; the volumes of the pipette it replaced go to the other pipette if it holds them, otherwise to the p1000
+def pick_pipette(mounts, use_p300, volume):
+    pipette = 'p300' if use_p300 else 'p20'
+    if 'p1000' not in mounts:
+        return pipette
+    if pipette in mounts:
+        return 'p1000' if volume > pipette_specs[pipette]['max_volume'] and volume >= pipette_specs['p1000']['min_volume'] else pipette
+    other = next(name for name in mounts if name != 'p1000')
+    return other if volume <= pipette_specs[other]['max_volume'] else 'p1000'
+
+
+# bulk transfers into tubes (more than one tip-full of the p300 or p1000): as few equal strokes as the pipette can take, so none
+# is a tiny trailing aspiration, all on one tip. All but the last stroke dispense above the liquid so the tip stays clean to go back to the source;
+# the last dispenses at the usual height and does the mix. A destination too full to dispense above keeps a tip per stroke.
+# loaded is the uL the operator puts in each tube
+def plan_strokes(commands, loaded):
+    planned = []
+    volumes = dict(loaded) # uL in each tube so far
+    clearance = {} # dispense clearance of each pipette so far
+    for command in commands:
+        if isinstance(command, Setting) and command.attribute == 'clearance.dispense':
+            clearance[command.pipette] = command.value
+        count = math.ceil(command.volume / pipette_specs[command.pipette]['max_volume']) if isinstance(command, Transfer) else 1
+        before = volumes.get(command.dest, 0) if isinstance(command, Transfer) else 0
+        height = liquid_height(before + command.volume * (count - 1) / count) + stroke_margin if count > 1 else 0
+        if count > 1 and command.pipette != 'p20' and command.new_tip == 'always' and command.dest[0].startswith('tuberack') and height <= highest_dispense:
+            step, pipette = command.step, command.pipette
+            planned += [Tip(step, pipette, 'pick_up'), Setting(step, pipette, 'clearance.dispense', round(height, 1))]
+            for number in range(count):
+                if number == count - 1:
+                    planned.append(Setting(step, pipette, 'clearance.dispense', clearance.get(pipette, 1)))
+                planned.append(Transfer(step, command.label + ' (' + str(number + 1) + '/' + str(count) + ')', pipette, command.volume / count, command.source, command.dest,
+                    mix_before=command.mix_before if number == 0 else (0,0), mix_after=command.mix_after if number == count - 1 else (0,0),
+                    new_tip='never', line=command.line, liquid=command.liquid))
+            planned.append(Tip(step, pipette, 'drop'))
+        else:
+            planned.append(command)
+        for source, dest, volume in moves(command):
+            volumes[source] = volumes.get(source, 0) - volume
+            volumes[dest] = volumes.get(dest, 0) + volume
+    return planned
+
+
+def compile_commands(plan, deck):
+    settings = plan.settings
+    reagent = reagent_wells(deck)
+    commands = []
+
+    # mixes are capped at what the pipette holds, for volumes a p1000 or the remaining pipette takes over
+    def transfer(step, label, use_p300, volume, source, dest, liquid, **options):
+        pipette = pick_pipette(deck.mounts, use_p300, volume)
+        max_volume = pipette_specs[pipette]['max_volume']
+        for mix in ('mix_before', 'mix_after'):
+            if mix in options:
+                options[mix] = (options[mix][0], min(options[mix][1], max_volume))
+        commands.append(Transfer(step, label, pipette, volume, source, dest, liquid=liquid_class(settings, liquid), **options))
+
+    # a setting on each mounted pipette; values is one value for all of them, or one per pipette
+    def set_all(step, attribute, values):
+        for pipette in deck.mounts:
+            commands.append(Setting(step, pipette, attribute, values[pipette] if isinstance(values, dict) else values))
+
+    # specify custom pipette parameters
+    flow_rates = {'p300': settings.p300_flow_rate, 'p20': settings.p20_flow_rate, 'p1000': settings.p1000_flow_rate}
+    set_all('DNA transfer', 'flow_rate.aspirate', flow_rates)
+    set_all('DNA transfer', 'flow_rate.dispense', flow_rates)
+    set_all('DNA transfer', 'clearance.aspirate', settings.DNA_aspirate_clearance)
+    set_all('DNA transfer', 'clearance.dispense', settings.dispense_clearance)
+
+    # Step 1) transfer DNA from source tubes to destination tubes
+    entries = plan.entries
+    mixed_sources = set()
+
+    # DNA sources are csv tubes, or premix and dilution tubes from the deck allocator
+    def DNA_tube(source):
+        return reagent[source] if source in reagent else tube(source)
+
+    def DNA_label(source):
+        return source if source in reagent else 'DNA ' + source
+
+    # dilute the DNA too concentrated to pipette: diluent into each empty dilution tube on one tip per pipette, then the stock,
+    # mixed in
+    if plan.dilutions:
+        diluent = 'Water' if settings.diluent == 'water' else 'Opti-MEM'
+        start = len(commands)
+        for dilution in plan.dilutions:
+            transfer('DNA transfer', diluent + ' -> ' + dilution.name, dilution.diluent > 20, dilution.diluent, reagent[diluent], reagent[dilution.name], 'Opti-MEM', new_tip='never')
+        used = list(dict.fromkeys(command.pipette for command in commands[start:]))
+        commands[start:start] = [Tip('DNA transfer', pipette, 'pick_up') for pipette in used]
+        commands += [Tip('DNA transfer', pipette, 'drop') for pipette in used]
+        for dilution in plan.dilutions:
+            mix_param_before = (3,20)
+            if settings.mix_source_once and dilution.source in mixed_sources:
+                mix_param_before = (0,0)
+            mixed_sources.update((dilution.source, dilution.name))
+            transfer('DNA transfer', 'DNA ' + dilution.source + ' -> ' + dilution.name, dilution.stock >= 20, dilution.stock, tube(dilution.source), reagent[dilution.name], 'aqueous DNA',
+                mix_before=mix_param_before, mix_after=(3,min(dilution.stock + dilution.diluent, 200 if dilution.stock >= 20 else 20)))
+
+    # pool the DNA shared by several co-transfections into premix tubes first, mixing each once it is complete
+    for premix in plan.premixes:
+        for number, (source, volume) in enumerate(premix.parts):
+            mix_param_before = (3,20)
+            if settings.mix_source_once and source in mixed_sources:
+                mix_param_before = (0,0)
+            mixed_sources.add(source)
+            mix_param = (0,0)
+            if number == len(premix.parts)-1:
+                mix_param = (3,min(sum(part for _, part in premix.parts), 200 if volume >= 20 else 20))
+            transfer('DNA transfer', DNA_label(source) + ' -> ' + premix.name, volume >= 20, volume, DNA_tube(source), reagent[premix.name], 'aqueous DNA',
+                mix_before=mix_param_before, mix_after=mix_param)
+        mixed_sources.add(premix.name)
+
+    # mix co-transfection tubes after their last DNA goes in
+    mix_params = []
+    for a, entry in enumerate(entries):
+        mix_param = (0,0)
+        if settings.mix_cotransfections and entry.transfection_type == 'Co':
+            if a == len(entries)-1 or entries[a+1].DNA_dest != entry.DNA_dest:
+                mix_param = (3,20)
+        mix_params.append(mix_param)
+
+    dispensed = set() # entries already done by a multi-dispense
+    DNA_in = {} # uL of DNA in each destination tube so far
+    for a, entry in enumerate(entries):
+        if a in dispensed:
+            continue
+
+        # figure out whether a DNA source tube needs to be mixed or not
+        mix_param_before = (3,20)
+        if settings.mix_source_once and entry.DNA_source in mixed_sources:
+            mix_param_before = (0,0)
+        mixed_sources.add(entry.DNA_source)
+
+        # multi-dispense: one tip takes this source's DNA to each later destination it can reach without touching liquid there. It
+        # dispenses stroke_margin above the highest liquid any of them ends up with, so the disposal volume it blows back into the
+        # source has only touched the source; a destination that gets mixed, or would fill past highest_dispense, gets its own transfer,
+        # and so does a draw too big to go up with the disposal volume in one tip-full of the pipette
+        use_p300 = entry.uL_DNA >= 20
+        pipette = pick_pipette(deck.mounts, use_p300, entry.uL_DNA)
+        fill_limit = pipette_specs[pipette]['max_volume'] - pipette_specs[pipette]['min_volume']
+        batch = [a]
+        if settings.multi_dispense_DNA and mix_params[a] == (0,0) and entry.uL_DNA <= fill_limit and dispense_height(DNA_in, entry) <= highest_dispense:
+            batch = [b for b in range(a, len(entries)) if b not in dispensed and entries[b].DNA_source == entry.DNA_source and
+                (entries[b].uL_DNA >= 20) == use_p300 and pick_pipette(deck.mounts, use_p300, entries[b].uL_DNA) == pipette and entries[b].uL_DNA <= fill_limit and
+                mix_params[b] == (0,0) and dispense_height(DNA_in, entries[b]) <= highest_dispense]
+
+        if len(batch) > 1:
+            commands.append(Distribute('DNA transfer', DNA_label(entry.DNA_source) + ' -> ' + ', '.join(entries[b].DNA_dest for b in batch), pipette,
+                DNA_tube(entry.DNA_source), [(tube(entries[b].DNA_dest), entries[b].uL_DNA) for b in batch], mix_before=mix_param_before,
+                disposal=pipette_specs[pipette]['min_volume'], height=round(max(dispense_height(DNA_in, entries[b]) for b in batch), 1), liquid=liquid_class(settings, 'aqueous DNA'), line=entry.line))
+            dispensed.update(batch)
+        else:
+            transfer('DNA transfer', DNA_label(entry.DNA_source) + ' -> ' + entry.DNA_dest, use_p300, entry.uL_DNA,
+                DNA_tube(entry.DNA_source), tube(entry.DNA_dest), 'aqueous DNA', mix_before=mix_param_before, mix_after=mix_params[a], line=entry.line)
+        for b in batch:
+            DNA_in[entries[b].DNA_dest] = DNA_in.get(entries[b].DNA_dest, 0) + entries[b].uL_DNA
+
+    set_all('OM/P3K MM', 'clearance.aspirate', settings.aspirate_clearance)
+    set_all('OM/P3K MM', 'clearance.dispense', settings.dispense_clearance)
+
+    # pause robot to allow time to get OM and P3K (and L3K, unless it gets its own pause); with minimize_pauses the reagents are
+    # loaded before the run starts and plan_run() drops the pause unless tip racks have to be swapped there
+    loaded_first = ['Opti-MEM', 'Opti-MEM 2', 'P3000', 'OM/P3K MM', 'OM/L3K MM']
+    if plan.dilutions and settings.diluent == 'Opti-MEM':
+        loaded_first.remove('Opti-MEM') # already on the deck for the dilutions
+    if settings.minimize_pauses:
+        commands.append(Pause('OM/P3K MM', 'tip rack swap before OM/P3K MM', '', needed=False))
+    elif settings.separate_L3K_pause:
+        commands.append(Pause('OM/P3K MM', 'get OM and P3000', 'Now, get your OM and P3000 and place them in the tuberacks: ' +
+            ', '.join(name + ' in ' + reagent_position(deck, name) for name in loaded_first if name in reagent) + '.'))
+    else:
+        commands.append(Pause('OM/P3K MM', 'get OM, P3000 and L3000', 'Now, get your OM, P3000, and L3000 and place them in the tuberacks: ' +
+            ', '.join(name + ' in ' + reagent_position(deck, name) for name in loaded_first + ['L3000'] if name in reagent) + '.'))
+
+    # Step 2) Adding OM/P3000 master mix to DNA tubes, mixing with OM/L3000
+    OM_MM_vol = plan.OM_MM_vol
+
+    # Opti-MEM into a master mix tube, mixed after
+    def add_OM(step, source, dest):
+        if OM_MM_vol > 200:
+            transfer(step, 'Opti-MEM -> ' + dest, True, OM_MM_vol, reagent[source], reagent[dest], 'Opti-MEM', mix_after=(3,200))
+        else:
+            transfer(step, 'Opti-MEM -> ' + dest, OM_MM_vol > 20, OM_MM_vol, reagent[source], reagent[dest], 'Opti-MEM', mix_after=(3,OM_MM_vol))
+
+    # prepare OM/P3K MM
+    transfer('OM/P3K MM', 'P3000 -> OM/P3K MM', plan.P3K_MM_vol >= 20, plan.P3K_MM_vol, reagent['P3000'], reagent['OM/P3K MM'], 'P3000')
+    add_OM('OM/P3K MM', 'Opti-MEM', 'OM/P3K MM')
+
+    # distribute OM/P3K MM to DNA dest tubes, which have DNA in them; the master mixes are nearly all Opti-MEM and pipette like it
+    for group in plan.groups:
+        volume = group.OM_P3K_MM_vol
+        if volume > 200:
+            mix_after = (3,200)
+        elif volume > 20:
+            mix_after = (3,volume)
+        else:
+            mix_after = (3,15)
+        transfer('OM/P3K MM', 'OM/P3K MM -> ' + group.DNA_dest, volume > 20, volume, reagent['OM/P3K MM'], tube(group.DNA_dest), 'Opti-MEM', mix_after=mix_after, line=group.entries[0].line)
+
+    # prepare OM/L3K MM
+    # pause robot to allow time to get L3K
+    if settings.minimize_pauses:
+        commands.append(Pause('OM/L3K MM', 'tip rack swap before OM/L3K MM', '', needed=False))
+    elif settings.separate_L3K_pause:
+        commands.append(Pause('OM/L3K MM', 'get L3000', 'Now, get your L3000 and place it in the tuberack: L3000 in ' + reagent_position(deck, 'L3000') + '.'))
+
+    transfer('OM/L3K MM', 'L3000 -> OM/L3K MM', plan.L3K_MM_vol >= 20, plan.L3K_MM_vol, reagent['L3000'], reagent['OM/L3K MM'], 'Lipofectamine 3000')
+    if plan.OM_refill:
+        transfer('OM/L3K MM', 'Opti-MEM 2 -> Opti-MEM', True, OM_MM_vol, reagent['Opti-MEM 2'], reagent['Opti-MEM'], 'Opti-MEM')
+    add_OM('OM/L3K MM', 'Opti-MEM', 'OM/L3K MM')
+
+    # distribute OM/L3K MM to empty tubes, with one tip on each pipette (a p1000 only if it takes any of them)
+    start = len(commands)
+    for group in plan.groups:
+        volume = group.OM_L3K_MM_vol
+        transfer('OM/L3K MM', 'OM/L3K MM -> ' + group.L3K_dest, volume > 20, volume, reagent['OM/L3K MM'], tube(group.L3K_dest), 'Opti-MEM', new_tip='never', line=group.entries[0].line)
+    used = [pipette for pipette in deck.mounts if pipette != 'p1000' or any(command.pipette == pipette for command in commands[start:])]
+    commands[start:start] = [Tip('OM/L3K MM', pipette, 'pick_up') for pipette in used]
+    commands += [Tip('OM/L3K MM', pipette, 'drop') for pipette in used]
+
+    # pipette OM/P3K/DNA mixture into OM/L3K mixture
+    for group in plan.groups:
+        volume = group.mixing_vol
+        if volume > 200:
+            mix_after = (3,200)
+        elif volume > 20:
+            mix_after = (3,volume)
+        else:
+            mix_after = (3,20)
+        transfer('complex mixing', 'DNA/P3K mix ' + group.DNA_dest + ' -> ' + group.L3K_dest, volume > 20, volume, tube(group.DNA_dest), tube(group.L3K_dest), 'lipid-DNA complex', mix_after=mix_after, line=group.entries[0].line)
+
+    # pause robot to allow time to get cells and incubate transfection mixes; with minimize_pauses the robot times the incubation
+    # itself, and only pauses for the cells if they aren't on the deck already
+    if not settings.minimize_pauses:
+        commands.append(Pause('plate addition', 'incubate and get cells', 'Now, incubate the mixture for 10 mins and get your cells and place in the deck specified in the OT-2 protocol.'))
+    else:
+        if not settings.cells_up_front:
+            commands.append(Pause('plate addition', 'get cells', 'Now, get your cells and place them in the deck specified in the OT-2 protocol. The incubation of the mixture is timed from the end of mixing and carries on when you resume.'))
+        commands.append(Delay('plate addition', 'incubation', 'Incubating the transfection mixes:', settings.incubation_minutes * 60))
+
+    # Step 3) Adding transfection mixes to cells
+    for pipette in deck.mounts:
+        if pipette != 'p20':
+            commands.append(Setting('plate addition', pipette, 'flow_rate.dispense', settings.plate_dispense_flow_rate))
+    set_all('plate addition', 'clearance.dispense', settings.plate_dispense_clearance)
+    for plate_transfer in plan.plate_transfers:
+        volume = plate_transfer.transfection_vol
+        transfer('plate addition', 'transfection mix ' + plate_transfer.source + ' -> plate ' + plate_transfer.plate_dest, volume >= 20, volume,
+            tube(plate_transfer.source), plate_well(plate_transfer.plate_dest), 'cell addition', line=plate_transfer.rows[0].line)
+
+    if settings.plan_strokes:
+        commands = plan_strokes(commands, {reagent[name]: volume for name, volume in reagent_load_volumes(plan).items()})
+    return commands
@@ -0,0 +1,273 @@
+# deck layout - where the labware, reagent tubes and tip racks go
+from dataclasses import dataclass, field
+
+from .plan import tube_wells, valid_location, diluent_volume
+
+
+tuberack_model = "opentrons_24_tuberack_eppendorf_1.5ml_safelock_snapcap"
+plate_model = "corning_24_wellplate_3.4ml_flat"
+tips_per_rack = 96
+
+# pipettes the protocol can load, by the short name used everywhere else; min_volume is the rated minimum, default_flow_rate (uL/sec) what the robot uses until the protocol sets one
+pipette_specs = {
+    'p300': {'model': "p300_single_gen2", 'max_volume': 300, 'min_volume': 20, 'tip_rack': "opentrons_96_tiprack_300ul", 'default_flow_rate': 92.86},
+    'p20': {'model': "p20_single_gen2", 'max_volume': 20, 'min_volume': 1, 'tip_rack': "opentrons_96_tiprack_20ul", 'default_flow_rate': 7.56},
+    'p1000': {'model': "p1000_single_gen2", 'max_volume': 1000, 'min_volume': 100, 'tip_rack': "opentrons_96_tiprack_1000ul", 'default_flow_rate': 274.7},
+    }
+
+# bulk Opti-MEM sources (Settings.OM_source): labware, the well the Opti-MEM goes in, and the uL it holds
+bulk_models = {
+    'reservoir': ("nest_12_reservoir_15ml", 'A1', 15000),
+    'conical': ("opentrons_10_tuberack_falcon_4x50ml_6x15ml_conical", 'A3', 50000),
+    }
+
+
+@dataclass
+class Deck:
+    tuberack_slots: dict = field(default_factory=lambda: {'1': '4', '2': '5', '3': '6'}) # rack number in the csv -> deck slot
+    plate_slots: dict = field(default_factory=lambda: {'1': '2', '2': '3'})
+    mounts: dict = field(default_factory=lambda: {'p300': 'right', 'p20': 'left'}) # pipettes loaded, and their mounts
+    tip_rack_slots: dict = field(default_factory=lambda: {'p300': ['9'], 'p20': ['8']})
+    free_slots: list = field(default_factory=lambda: ['1', '7', '10', '11']) # an extra reagent tube rack or tip racks can go here
+    reagent_tubes: dict = field(default_factory=dict) # reagent name -> tube location, e.g. 'D1.3'
+    reagent_rack_slot: str = None # slot of the extra tube rack (rack 4) when the csv leaves no room for the reagents
+    bulk_source: str = None # 'reservoir' or 'conical' when the Opti-MEM comes from there (see bulk_models), loaded as labware 'bulk'
+    bulk_slot: str = None
+
+
+# labware name and well for a csv tube location like 'A1.2'
+def tube(location):
+    well, _, rack = location.partition('.')
+    return ('tuberack' + rack, well)
+
+
+def plate_well(location):
+    well, _, plate = location.partition('.')
+    return ('plate' + plate, well)
+
+
+# approximate position of a tube on the deck in mm, from the OT-2 slot grid and the 24-tube rack well spacing
+def tube_xy(deck, location):
+    well, _, rack = location.partition('.')
+    slot = int(deck.tuberack_slots[rack]) - 1
+    x = (slot % 3) * 132.5 + 18.21 + (int(well[1:]) - 1) * 19.89
+    y = (slot // 3) * 90.5 + 75.43 - 'ABCD'.index(well[0]) * 19.28
+    return x, y
+
+
+def slot_xy(slot):
+    slot = int(slot) - 1
+    return (slot % 3) * 132.5 + 64, (slot // 3) * 90.5 + 43
+
+
+def travel(deck, location, targets):
+    x, y = tube_xy(deck, location)
+    distance = 0
+    for target in targets:
+        target_x, target_y = tube_xy(deck, target)
+        distance += ((x - target_x)**2 + (y - target_y)**2) ** 0.5
+    return distance
+
+
+# put a p1000 on a mount in place of the pipette there; its tip racks take over that pipette's slots
+def mount_p1000(deck, mount):
+    replaced = next(name for name, other in deck.mounts.items() if other == mount)
+    del deck.mounts[replaced]
+    deck.mounts['p1000'] = mount
+    deck.tip_rack_slots['p1000'] = deck.tip_rack_slots.pop(replaced)
+    return deck
+
+
+# put the reservoir or conical rack in the free slot closest to the master mix tubes it fills
+def place_bulk_source(deck, source):
+    targets = [tube_xy(deck, deck.reagent_tubes[name]) for name in ('OM/P3K MM', 'OM/L3K MM') if name in deck.reagent_tubes]
+
+    def distance(slot):
+        x, y = slot_xy(slot)
+        return sum(((x - target_x)**2 + (y - target_y)**2) ** 0.5 for target_x, target_y in targets)
+
+    if not deck.free_slots:
+        return deck
+    deck.bulk_source = source
+    deck.bulk_slot = min(deck.free_slots, key=distance)
+    deck.free_slots = [slot for slot in deck.free_slots if slot != deck.bulk_slot]
+    return deck
+
+
+# labware and well of each reagent: the allocator's tubes, and the Opti-MEM in the reservoir or conical tube when there is one
+def reagent_wells(deck):
+    wells = {name: tube(location) for name, location in deck.reagent_tubes.items()}
+    if deck.bulk_source:
+        wells['Opti-MEM'] = ('bulk', bulk_models[deck.bulk_source][1])
+    return wells
+
+
+# tubes from the csv, which the reagents can't use; the rows as well as the entries, as a DNA source that is only drawn from
+# through a premix or dilution is still on the deck
+def used_tubes(plan):
+    used = set()
+    for item in plan.entries + plan.rows:
+        used.update((item.DNA_source, item.DNA_dest, item.L3K_dest))
+    return used
+
+
+# reagent tubes the plan needs, each with the tubes it is pipetted into; master mixes, DNA premixes and dilutions come first
+# (one transfer per DNA/L3K tube), then the reagents that go into them
+def wanted_reagents(plan, deck):
+    racks = list(deck.tuberack_slots)
+    DNA_tubes = sorted(set(group.DNA_dest for group in plan.groups if valid_location(group.DNA_dest, racks)))
+    L3K_tubes = sorted(set(group.L3K_dest for group in plan.groups if valid_location(group.L3K_dest, racks)))
+    wanted = [
+        ('OM/P3K MM', lambda allocated: DNA_tubes),
+        ('OM/L3K MM', lambda allocated: L3K_tubes),
+        ]
+    for premix in plan.premixes:
+        wanted.append((premix.name, lambda allocated, premix=premix: [group.DNA_dest for group in premix.groups if valid_location(group.DNA_dest, racks)]))
+    for dilution in plan.dilutions:
+        wanted.append((dilution.name, lambda allocated, dilution=dilution: [location for location in [dilution.source] + [entry.DNA_dest for entry in dilution.entries] if valid_location(location, racks)]))
+    wanted += [
+        ('P3000', lambda allocated: [allocated['OM/P3K MM']]),
+        ('L3000', lambda allocated: [allocated['OM/L3K MM']]),
+        ]
+    if plan.settings.OM_source == 'tube':
+        wanted.append(('Opti-MEM', lambda allocated: [allocated['OM/P3K MM'], allocated['OM/L3K MM']]))
+    if plan.OM_refill:
+        wanted.append(('Opti-MEM 2', lambda allocated: [allocated['Opti-MEM']]))
+    if diluent_volume(plan, 'water'):
+        wanted.append(('Water', lambda allocated: [allocated[dilution.name] for dilution in plan.dilutions]))
+    return wanted
+
+
+# put each reagent tube at the free position closest to the tubes it is pipetted into
+def place_reagent_tubes(plan, deck, free):
+    free = list(free)
+    allocated = {}
+    distance = 0
+    for name, targets in wanted_reagents(plan, deck):
+        if not free:
+            return None, 0
+        targets = targets(allocated)
+        best = min(free, key=lambda location: travel(deck, location, targets))
+        distance += travel(deck, best, targets)
+        allocated[name] = best
+        free.remove(best)
+    return allocated, distance
+
+
+# use free positions in the csv tube racks if there are enough, otherwise add a reagent tube rack (rack 4) in whichever free deck slot gives the least travel
+def allocate_reagent_tubes(plan, deck):
+    if plan.settings.reagent_positions:
+        deck.reagent_tubes = {name: location for name, location in plan.settings.reagent_positions.items() if name in dict(wanted_reagents(plan, deck))}
+        return deck
+
+    used = used_tubes(plan)
+    free = [well + '.' + rack for rack in sorted(deck.tuberack_slots) for well in tube_wells if well + '.' + rack not in used]
+    allocated, distance = place_reagent_tubes(plan, deck, free)
+    if not allocated:
+        best_slot = None
+        for slot in deck.free_slots:
+            deck.tuberack_slots['4'] = slot
+            option, distance = place_reagent_tubes(plan, deck, free + [well + '.4' for well in tube_wells])
+            if best_slot is None or distance < best_distance:
+                allocated, best_slot, best_distance = option, slot, distance
+        deck.tuberack_slots['4'] = best_slot
+        deck.reagent_rack_slot = best_slot
+        deck.free_slots = [slot for slot in deck.free_slots if slot != best_slot]
+    deck.reagent_tubes = allocated
+    return deck
+
+
+# volume the operator should load into each reagent tube
+def reagent_load_volumes(plan):
+    volumes = {'OM/P3K MM': 0, 'OM/L3K MM': 0, 'P3000': plan.P3K_MM_vol, 'L3000': plan.L3K_MM_vol}
+    for premix in plan.premixes:
+        volumes[premix.name] = 0
+    for dilution in plan.dilutions:
+        volumes[dilution.name] = 0
+    if plan.OM_refill:
+        volumes['Opti-MEM'] = plan.OM_MM_vol + diluent_volume(plan, 'Opti-MEM')
+        volumes['Opti-MEM 2'] = plan.OM_MM_vol
+    else:
+        volumes['Opti-MEM'] = 2*plan.OM_MM_vol + diluent_volume(plan, 'Opti-MEM')
+    if diluent_volume(plan, 'water'):
+        volumes['Water'] = diluent_volume(plan, 'water')
+    return volumes
+
+
+# deck position of a reagent tube, as shown to the operator
+def reagent_position(deck, name):
+    if name not in deck.reagent_tubes and name == 'Opti-MEM' and deck.bulk_source:
+        return deck.bulk_source + ' (slot ' + deck.bulk_slot + ') ' + bulk_models[deck.bulk_source][1]
+    well, _, rack = deck.reagent_tubes[name].partition('.')
+    return 'tuberack' + rack + ' (slot ' + deck.tuberack_slots[rack] + ') ' + well
+
+
+# load extra tip racks in the free deck slots for whichever pipette is furthest short of tips, then schedule full-rack replacements
+# at the existing pauses for anything still missing, so the robot never runs out of tips between pauses
+def plan_tip_racks(deck, tip_demand, pause_names):
+    errors = []
+    totals = {pipette: sum(stretch[pipette] for stretch in tip_demand) for pipette in deck.tip_rack_slots}
+    while deck.free_slots:
+        shortfall = {pipette: totals[pipette] - len(deck.tip_rack_slots[pipette]) * tips_per_rack for pipette in deck.tip_rack_slots}
+        pipette = max(shortfall, key=shortfall.get)
+        if shortfall[pipette] <= 0:
+            break
+        deck.tip_rack_slots[pipette].append(deck.free_slots.pop(0))
+
+    # replace the racks at a pause only when the tips left can't cover the stretch up to the next pause
+    replacements = {} # pause index -> pipettes whose racks are swapped for full ones at that pause
+    for pipette in deck.tip_rack_slots:
+        capacity = len(deck.tip_rack_slots[pipette]) * tips_per_rack
+        used = 0
+        for stretch in range(len(tip_demand)):
+            needed = tip_demand[stretch][pipette]
+            if stretch > 0 and used + needed > capacity:
+                replacements.setdefault(stretch - 1, []).append(pipette)
+                used = 0
+            if needed > capacity:
+                errors.append(pipette + ' needs ' + str(needed) + ' tips ' + ('before the first pause' if stretch == 0 else 'after the "' + pause_names[stretch - 1] + '" pause') + ' but only ' + str(capacity) + ' fit on the deck; the run would stop when the tip racks run out')
+            used += needed
+    return replacements, errors
+
+
+# tell the operator which tip racks to swap for full ones at a pause
+def tip_replacement_message(deck, pipettes, also=True):
+    message = ''
+    for pipette in pipettes:
+        message += (' Also replace the ' if also or message else 'Replace the ') + pipette + ' tip racks in slot(s) ' + ', '.join(deck.tip_rack_slots[pipette]) + ' with full racks.'
+    return message
+
+
+# print where each reagent tube goes, with one grid per tube rack that holds reagents (* = DNA/L3K tube from the csv, . = empty),
+# and the tip racks
+def print_loading_map(plan, deck, tip_demand, replacements, pause_names):
+    print('Operator loading map - reagent tubes:')
+    if plan.settings.minimize_pauses:
+        print('  load all of these before starting the run; the robot does not pause for reagents')
+    if plan.dilutions:
+        print('  the robot dilutes ' + ', '.join(dilution.source + ' ' + str(dilution.factor) + 'x' for dilution in plan.dilutions) + ' at the start of Step 1, so the '
+            + ('water' if plan.settings.diluent == 'water' else 'Opti-MEM') + ' has to be loaded before starting the run')
+    volumes = reagent_load_volumes(plan)
+    for name in deck.reagent_tubes:
+        amount = 'empty tube' if volumes[name] == 0 else str(round(volumes[name], 1)) + ' uL'
+        print('  ' + name.ljust(11) + ' -> ' + reagent_position(deck, name) + ', ' + amount)
+    if deck.bulk_source:
+        print('  ' + 'Opti-MEM'.ljust(11) + ' -> ' + reagent_position(deck, 'Opti-MEM') + ', ' + str(round(volumes['Opti-MEM'], 1)) + ' uL')
+    labels = {location: name for name, location in deck.reagent_tubes.items()}
+    used = used_tubes(plan)
+    for rack in sorted(set(location.split('.')[-1] for location in deck.reagent_tubes.values())):
+        print('  tuberack' + rack + ' (slot ' + deck.tuberack_slots[rack] + ')')
+        print('     ' + ''.join(str(column).ljust(12) for column in range(1,7)))
+        for row in 'ABCD':
+            cells = []
+            for column in range(1,7):
+                location = row + str(column) + '.' + rack
+                cells.append(labels[location] if location in labels else ('*' if location in used else '.'))
+            print('  ' + row + '  ' + ''.join(cell.ljust(12) for cell in cells))
+    print('Tip racks:')
+    if 'p1000' in deck.mounts:
+        print('  the p1000 goes on the ' + deck.mounts['p1000'] + ' mount')
+    for pipette, slots in deck.tip_rack_slots.items():
+        print('  ' + pipette.ljust(11) + ' -> slot(s) ' + ', '.join(slots) + ', ' + str(sum(stretch[pipette] for stretch in tip_demand)) + ' tips needed')
+    for pause, pipettes in sorted(replacements.items()):
+        print('  replace the ' + ' and '.join(pipettes) + ' tip racks at the "' + pause_names[pause] + '" pause')
@@ -0,0 +1,239 @@
+# command-stream diff - what a protocol revision or a plate map change does differently on the robot, and what it costs in time
+#   python -m ot2_transfection diff "OT2 automated transfection v3.6.py" "OT2 automated transfection v3.7.py" --max-slowdown 60
+import contextlib
+import difflib
+import importlib.util
+import io
+import pathlib
+
+from .commands import Transfer, Distribute, Pause, Tip, Setting, tips_used
+from .deck import Deck, tuberack_model, plate_model, pipette_specs
+from .protocol import plan_run, plan_with_changes
+from .timing import command_seconds
+
+
+# stands in for the ProtocolContext of a script that pipettes directly (v1-v3.7), recording what its run() asks the robot to do
+class RecordingProtocol:
+    def __init__(self):
+        self.commands = []
+        self.deck = Deck(tuberack_slots={}, plate_slots={}, mounts={}, tip_rack_slots={}, free_slots=[])
+        self.segment = 1
+
+    def load_labware(self, model, location, *args, **kwargs):
+        location = str(location)
+        if model == tuberack_model:
+            name = 'tuberack' + str(len(self.deck.tuberack_slots) + 1)
+            self.deck.tuberack_slots[name[len('tuberack'):]] = location
+        elif model == plate_model:
+            name = 'plate' + str(len(self.deck.plate_slots) + 1)
+            self.deck.plate_slots[name[len('plate'):]] = location
+        else:
+            name = model
+        return RecordedLabware(name, location)
+
+    def load_instrument(self, model, mount, tip_racks=(), *args, **kwargs):
+        name = next(name for name, spec in pipette_specs.items() if spec['model'] == model)
+        self.deck.mounts[name] = mount
+        self.deck.tip_rack_slots[name] = [rack.slot for rack in tip_racks]
+        return RecordedPipette(self, name)
+
+    def pause(self, message=None):
+        self.commands.append(Pause(self.step(), 'pause ' + str(self.segment), message or ''))
+        self.segment += 1
+
+    def step(self):
+        return 'segment ' + str(self.segment)
+
+    def is_simulating(self):
+        return True
+
+    def comment(self, *args, **kwargs):
+        pass
+
+
+class RecordedLabware:
+    def __init__(self, name, slot):
+        self.name = name
+        self.slot = slot
+
+    def __getitem__(self, well):
+        return (self.name, well)
+
+
+class RecordedSettings:
+    def __init__(self, pipette, group):
+        object.__setattr__(self, 'pipette', pipette)
+        object.__setattr__(self, 'group', group)
+
+    def __setattr__(self, attribute, value):
+        protocol = self.pipette.protocol
+        protocol.commands.append(Setting(protocol.step(), self.pipette.name, self.group + '.' + attribute, value))
+
+
+class RecordedPipette:
+    def __init__(self, protocol, name):
+        self.protocol = protocol
+        self.name = name
+        self.flow_rate = RecordedSettings(self, 'flow_rate')
+        self.well_bottom_clearance = RecordedSettings(self, 'clearance')
+
+    def transfer(self, volume, source, dest, mix_before=(0,0), mix_after=(0,0), new_tip='once', blow_out=False, **kwargs):
+        self.protocol.commands.append(Transfer(self.protocol.step(), source[0] + ' ' + source[1] + ' -> ' + dest[0] + ' ' + dest[1], self.name, volume, source, dest,
+            mix_before=mix_before or (0,0), mix_after=mix_after or (0,0), new_tip=new_tip, blow_out=blow_out))
+
+    def pick_up_tip(self, *args, **kwargs):
+        self.protocol.commands.append(Tip(self.protocol.step(), self.name, 'pick_up'))
+
+    def drop_tip(self, *args, **kwargs):
+        self.protocol.commands.append(Tip(self.protocol.step(), self.name, 'drop'))
+
+
+# command stream, deck and plan of a plate map (.csv, planned with settings) or a protocol script: library scripts are planned,
+# older scripts are run against a RecordingProtocol and have no plan; anything the script prints is dropped. Given the plan of
+# the revision before (previous), a plate map is planned with plan_with_changes(), which says which transfections the edit touched
+def load_stream(path, settings=None, previous=None):
+    def plan_plate_map(csv_raw, settings):
+        plan = plan_run(csv_raw, settings) if previous is None else plan_with_changes(previous, csv_raw, settings)
+        return plan.commands, plan.deck, plan
+
+    if path.endswith('.csv'):
+        return plan_plate_map(pathlib.Path(path), settings)
+    spec = importlib.util.spec_from_file_location('revision', path)
+    script = importlib.util.module_from_spec(spec)
+    with contextlib.redirect_stdout(io.StringIO()):
+        spec.loader.exec_module(script)
+        if hasattr(script, 'plan') and hasattr(script, 'settings'):
+            return plan_plate_map(script.csv_raw, script.settings)
+        protocol = RecordingProtocol()
+        script.run(protocol)
+    return protocol.commands, protocol.deck, None
+
+
+# pause-delimited segments, so scripts with and without step names compare
+def segments(commands):
+    names, segment = [], 1
+    for command in commands:
+        names.append('segment ' + str(segment))
+        if isinstance(command, Pause):
+            segment += 1
+    return names
+
+
+def slot_location(deck, labware_well):
+    labware, well = labware_well
+    if labware == 'bulk':
+        return 'slot ' + deck.bulk_slot + ' ' + well
+    if labware.startswith('tuberack'):
+        return 'slot ' + deck.tuberack_slots[labware[len('tuberack'):]] + ' ' + well
+    return 'slot ' + deck.plate_slots[labware[len('plate'):]] + ' ' + well
+
+
+# one record per liquid movement, with the flow rates and heights in effect and locations as deck slots, so two streams that
+# name their labware differently still line up
+def normalize(commands, deck):
+    records = []
+    state = {name: {'flow_rate.aspirate': spec['default_flow_rate'], 'flow_rate.dispense': spec['default_flow_rate'], 'clearance.aspirate': 1, 'clearance.dispense': 1}
+        for name, spec in pipette_specs.items()}
+    for command, segment in zip(commands, segments(commands)):
+        if isinstance(command, Setting):
+            state[command.pipette][command.attribute] = command.value
+        if not isinstance(command, (Transfer, Distribute)):
+            continue
+        settings = dict(state[command.pipette])
+        liquid = command.liquid
+        if liquid is not None:
+            settings['flow_rate.aspirate'] = liquid.aspirate_flow_rate.get(command.pipette, settings['flow_rate.aspirate'])
+            settings['flow_rate.dispense'] = liquid.dispense_flow_rate.get(command.pipette, settings['flow_rate.dispense'])
+        dests = command.dests if isinstance(command, Distribute) else [(command.dest, command.volume)]
+        for dest, volume in dests:
+            records.append({
+                'segment': segment,
+                'source': slot_location(deck, command.source),
+                'dest': slot_location(deck, dest),
+                'pipette': command.pipette,
+                'volume': round(volume, 2),
+                'mix_before': list(command.mix_before),
+                'mix_after': list(getattr(command, 'mix_after', (0,0))),
+                'tip': 'new' if isinstance(command, Distribute) or command.new_tip == 'always' else 'shared',
+                'blow_out': isinstance(command, Distribute) or (command.blow_out and (liquid is None or liquid.blow_out)),
+                'liquid': liquid.name if liquid is not None else None,
+                'aspirate_delay': liquid.aspirate_delay if liquid is not None else 0,
+                'dispense_delay': liquid.dispense_delay if liquid is not None else 0,
+                'flow_rate': [settings['flow_rate.aspirate'], settings['flow_rate.dispense']],
+                'clearance': [settings['clearance.aspirate'], settings['clearance.dispense']],
+                })
+    return records
+
+
+compared_fields = ['pipette', 'volume', 'mix_before', 'mix_after', 'tip', 'blow_out', 'liquid', 'aspirate_delay', 'dispense_delay', 'flow_rate', 'clearance']
+
+
+def stream_totals(commands, deck):
+    seconds = {}
+    for segment, command_time in zip(segments(commands), command_seconds(commands, deck)):
+        seconds[segment] = seconds.get(segment, 0) + command_time
+    tips = {name: 0 for name in pipette_specs}
+    for command in commands:
+        if getattr(command, 'pipette', None) in tips:
+            tips[command.pipette] += tips_used(command)
+    return seconds, tips
+
+
+# structured diff of two command streams (commands, deck, ...): transfers matched by source and destination, in order
+def diff_streams(a, b):
+    records_a, records_b = normalize(a[0], a[1]), normalize(b[0], b[1])
+    keys_a = [(record['source'], record['dest']) for record in records_a]
+    keys_b = [(record['source'], record['dest']) for record in records_b]
+    report = {'added': [], 'removed': [], 'changed': []}
+    for tag, a_start, a_end, b_start, b_end in difflib.SequenceMatcher(None, keys_a, keys_b, autojunk=False).get_opcodes():
+        if tag == 'equal':
+            pairs = list(zip(records_a[a_start:a_end], records_b[b_start:b_end]))
+        else:
+            report['removed'] += records_a[a_start:a_end]
+            report['added'] += records_b[b_start:b_end]
+            continue
+        for record_a, record_b in pairs:
+            changes = {field: [record_a[field], record_b[field]] for field in compared_fields if record_a[field] != record_b[field]}
+            if changes:
+                report['changed'].append({'transfer': record_a['source'] + ' -> ' + record_a['dest'], 'segment': record_a['segment'], 'changes': changes})
+
+    seconds_a, tips_a = stream_totals(a[0], a[1])
+    seconds_b, tips_b = stream_totals(b[0], b[1])
+    report['tips'] = {name: [tips_a[name], tips_b[name]] for name in pipette_specs if name in a[1].mounts or name in b[1].mounts}
+    report['pauses'] = [sum(isinstance(command, Pause) for command in a[0]), sum(isinstance(command, Pause) for command in b[0])]
+    report['estimated_seconds'] = {segment: [round(seconds_a.get(segment, 0)), round(seconds_b.get(segment, 0))] for segment in sorted(set(seconds_a) | set(seconds_b))}
+    report['estimated_seconds']['total'] = [round(sum(seconds_a.values())), round(sum(seconds_b.values()))]
+    report['slowdown'] = report['estimated_seconds']['total'][1] - report['estimated_seconds']['total'][0]
+    return report
+
+
+def diff_paths(path_a, path_b, settings=None):
+    a = load_stream(path_a, settings)
+    b = load_stream(path_b, settings, previous=a[2])
+    report = diff_streams(a, b)
+    # the transfections (by DNA destination) that are new or changed in b, and those gone from it, when both are plate maps
+    if b[2] is not None and b[2].changed is not None:
+        report['transfections'] = {'changed': b[2].changed, 'removed': b[2].removed}
+    return dict({'a': path_a, 'b': path_b}, **report)
+
+
+def print_diff(report):
+    print('--- ' + report['a'])
+    print('+++ ' + report['b'])
+    if 'transfections' in report:
+        transfections = report['transfections']
+        print('transfections changed: ' + (', '.join(transfections['changed']) or 'none') + '; removed: ' + (', '.join(transfections['removed']) or 'none'))
+    for record in report['removed']:
+        print('- ' + record['segment'] + ': ' + record['source'] + ' -> ' + record['dest'] + ', ' + str(record['volume']) + ' uL ' + record['pipette'])
+    for record in report['added']:
+        print('+ ' + record['segment'] + ': ' + record['source'] + ' -> ' + record['dest'] + ', ' + str(record['volume']) + ' uL ' + record['pipette'])
+    # group identical changes, e.g. a clearance change that touches every Step 1 transfer
+    grouped = {}
+    for change in report['changed']:
+        for field, (old, new) in change['changes'].items():
+            grouped.setdefault((field, str(old), str(new)), []).append(change['transfer'])
+    for (field, old, new), transfers in grouped.items():
+        print('~ ' + field + ': ' + old + ' -> ' + new + ' on ' + str(len(transfers)) + ' transfer(s)' + (', e.g. ' + transfers[0] if len(transfers) > 1 else ': ' + transfers[0]))
+    print('tips: ' + ', '.join(name + ' ' + str(old) + ' -> ' + str(new) for name, (old, new) in report['tips'].items()) + '; pauses: ' + str(report['pauses'][0]) + ' -> ' + str(report['pauses'][1]))
+    for segment, (old, new) in report['estimated_seconds'].items():
+        print('estimated ' + segment + ': ' + str(old) + ' s -> ' + str(new) + ' s (' + ('+' if new >= old else '') + str(new - old) + ' s)')
@@ -0,0 +1,227 @@
+# execution - loads the deck and plays the command stream on the robot
+import math
+import time
+
+from .commands import Transfer, Distribute, Pause, Delay, Tip, Setting, transfer_volumes, distribute_fills, moves
+from .deck import tuberack_model, plate_model, pipette_specs, bulk_models, tips_per_rack
+from .journal import Journal, resume_point, tips_taken, liquid_volumes, open_tip_pickups
+from .ledger import Ledger
+from .liquids import LiquidClass
+from .notify import notifier_for
+from .trace import RunTrace, TracedPipette, estimated_trace
+
+
+def load_labware(protocol, deck):
+    labware = {}
+    for rack, slot in deck.tuberack_slots.items():
+        labware['tuberack' + rack] = protocol.load_labware(tuberack_model, location=slot)
+    for plate, slot in deck.plate_slots.items():
+        labware['plate' + plate] = protocol.load_labware(plate_model, location=slot)
+    if deck.bulk_source:
+        labware['bulk'] = protocol.load_labware(bulk_models[deck.bulk_source][0], location=deck.bulk_slot)
+    return labware
+
+
+def load_pipettes(protocol, deck):
+    pipettes = {}
+    for name, mount in deck.mounts.items():
+        spec = pipette_specs[name]
+        tip_racks = [protocol.load_labware(spec['tip_rack'], location=slot) for slot in deck.tip_rack_slots[name]]
+        pipettes[name] = protocol.load_instrument(spec['model'], mount=mount, tip_racks=tip_racks)
+    return pipettes
+
+
+def apply_setting(pipette, command):
+    group, _, attribute = command.attribute.partition('.')
+    if group == 'flow_rate':
+        setattr(pipette.flow_rate, attribute, command.value)
+    else:
+        setattr(pipette.well_bottom_clearance, attribute, command.value)
+
+
+# a transfer with its liquid class: the same chunks, tips and mixes as pipette.transfer(), with the class's speeds and
+# delays; the pipette's own flow rates are put back after
+def liquid_transfer(protocol, pipette, command, source, dest):
+    liquid = command.liquid or LiquidClass('pipette') # no class: the pipette's own flow rates, and a blow out unless the command skips it
+    name = command.pipette
+    flow_rates = (pipette.flow_rate.aspirate, pipette.flow_rate.dispense)
+    pipette.flow_rate.aspirate = liquid.aspirate_flow_rate.get(name, flow_rates[0])
+    pipette.flow_rate.dispense = liquid.dispense_flow_rate.get(name, flow_rates[1])
+
+    for volume in transfer_volumes(command.volume, pipette.max_volume):
+        if command.new_tip == 'always':
+            pipette.pick_up_tip()
+        if command.mix_before[0]:
+            pipette.mix(command.mix_before[0], command.mix_before[1], source)
+        pipette.aspirate(volume, source)
+        if liquid.aspirate_delay:
+            protocol.delay(seconds=liquid.aspirate_delay)
+        if liquid.touch_tip:
+            pipette.touch_tip(source)
+        pipette.dispense(volume, dest)
+        if liquid.dispense_delay:
+            protocol.delay(seconds=liquid.dispense_delay)
+        if command.mix_after[0]:
+            pipette.mix(command.mix_after[0], command.mix_after[1], dest)
+        if liquid.blow_out and command.blow_out:
+            pipette.blow_out(dest)
+        if liquid.touch_tip:
+            pipette.touch_tip(dest)
+        if command.new_tip == 'always':
+            pipette.drop_tip()
+
+    pipette.flow_rate.aspirate, pipette.flow_rate.dispense = flow_rates
+
+
+# a multi-dispense: one tip, the source mixed once, each fill dispensed above the liquid in the destinations and its disposal volume blown back into the source
+def distribute(protocol, pipette, command, labware):
+    liquid = command.liquid or LiquidClass('pipette')
+    name = command.pipette
+    source = labware[command.source[0]][command.source[1]]
+    flow_rates = (pipette.flow_rate.aspirate, pipette.flow_rate.dispense)
+    pipette.flow_rate.aspirate = liquid.aspirate_flow_rate.get(name, flow_rates[0])
+    pipette.flow_rate.dispense = liquid.dispense_flow_rate.get(name, flow_rates[1])
+
+    pipette.pick_up_tip()
+    if command.mix_before[0]:
+        pipette.mix(command.mix_before[0], command.mix_before[1], source)
+    for fill in distribute_fills(command):
+        pipette.aspirate(sum(volume for _, volume in fill) + command.disposal, source)
+        if liquid.aspirate_delay:
+            protocol.delay(seconds=liquid.aspirate_delay)
+        if liquid.touch_tip:
+            pipette.touch_tip(source)
+        for dest, volume in fill:
+            pipette.dispense(volume, labware[dest[0]][dest[1]].bottom(command.height))
+            if liquid.dispense_delay:
+                protocol.delay(seconds=liquid.dispense_delay)
+        pipette.blow_out(source)
+    pipette.drop_tip()
+
+    pipette.flow_rate.aspirate, pipette.flow_rate.dispense = flow_rates
+
+
+# a timed wait with a countdown in the app, one delay per minute; idle is how long the robot has been waiting already
+def incubate(protocol, command, idle):
+    remaining = max(command.seconds - idle, 0)
+    while remaining > 0:
+        minutes_left = math.ceil(remaining / 60)
+        seconds = remaining - (minutes_left - 1) * 60
+        protocol.delay(seconds=seconds, msg=command.message + ' ' + str(minutes_left) + ' min left.')
+        remaining -= seconds
+
+
+def run_command(protocol, command, labware, pipettes, notifier, idle=0):
+    if isinstance(command, Transfer) and (command.liquid is not None or not command.blow_out):
+        liquid_transfer(protocol, pipettes[command.pipette], command, labware[command.source[0]][command.source[1]], labware[command.dest[0]][command.dest[1]])
+    elif isinstance(command, Transfer):
+        pipettes[command.pipette].transfer(
+            volume = command.volume,
+            source = labware[command.source[0]][command.source[1]],
+            dest = labware[command.dest[0]][command.dest[1]],
+            mix_before = command.mix_before,
+            mix_after = command.mix_after,
+            blow_out = True,
+            blowout_location = 'destination well',
+            new_tip = command.new_tip
+            )
+    elif isinstance(command, Distribute):
+        distribute(protocol, pipettes[command.pipette], command, labware)
+    elif isinstance(command, Pause):
+        notifier.notify(command.message)
+        protocol.pause(command.message)
+        # start from full tip racks again where plan_tip_racks() scheduled a replacement
+        for name in command.replace_tips:
+            pipettes[name].reset_tipracks()
+    elif isinstance(command, Delay):
+        incubate(protocol, command, idle)
+    elif isinstance(command, Tip):
+        if command.action == 'pick_up':
+            pipettes[command.pipette].pick_up_tip()
+        else:
+            pipettes[command.pipette].drop_tip()
+    elif isinstance(command, Setting):
+        apply_setting(pipettes[command.pipette], command)
+
+
+# continue a stopped run from its journal: point each pipette at its next unused tip, re-take tips the
+# pipettes held when the run stopped, and have the operator check the tubes of an interrupted transfer
+def resume(protocol, plan, journal, pipettes):
+    commands = plan.commands
+    events = journal.read()
+    if not events:
+        protocol.comment('No progress journal found for this plan, starting from the beginning.')
+        return 0
+    index, interrupted = resume_point(events, commands)
+    protocol.comment('Resuming at command ' + str(index + 1) + ' of ' + str(len(commands)) + '.')
+
+    for name, taken in tips_taken(commands, index, interrupted).items():
+        pipette = pipettes[name]
+        if taken >= len(pipette.tip_racks) * tips_per_rack:
+            protocol.pause('The ' + name + ' tip racks are used up; replace them with full racks.')
+            pipette.reset_tipracks()
+        elif taken > 0:
+            pipette.starting_tip = pipette.tip_racks[taken // tips_per_rack].wells()[taken % tips_per_rack]
+
+    if interrupted and isinstance(commands[index], (Transfer, Distribute)):
+        command = commands[index]
+        volumes = liquid_volumes(commands, index)
+        dests = [dest for _, dest, _ in moves(command)]
+        protocol.pause('The run stopped during: ' + command.label + '. Before continuing, check that ' + ', '.join(dest[0] + ' ' + dest[1] + ' holds about ' +
+            str(round(max(volumes.get(dest, 0), 0), 1)) + ' uL' for dest in dests) + ' and take out anything already added; the whole ' + str(round(command.volume, 1)) + ' uL will be transferred again.')
+
+    for pickup in open_tip_pickups(commands, index):
+        pipettes[commands[pickup].pipette].pick_up_tip()
+    return index
+
+
+def execute(protocol, plan):
+    labware = load_labware(protocol, plan.deck)
+    pipettes = load_pipettes(protocol, plan.deck)
+    notifier = notifier_for(protocol, plan.settings)
+    journal = Journal(plan.settings.journal_dir, plan, enabled=not protocol.is_simulating())
+
+    # a simulated run takes no time, so its trace is the estimate; a real run is timed as it goes
+    trace_file = plan.settings.trace_file
+    trace = RunTrace(plan.deck) if trace_file and not protocol.is_simulating() else None
+    if trace is not None:
+        pipettes = {name: TracedPipette(pipette, trace) for name, pipette in pipettes.items()}
+
+    start = resume(protocol, plan, journal, pipettes) if plan.settings.resume else 0
+    ledger = Ledger(plan.settings.ledger_file, plan, enabled=not protocol.is_simulating())
+    ledger.start(start)
+    worked = time.monotonic() # when the robot last finished something; a Delay counts from here
+    status = 'stopped'
+    try:
+        for index, command in enumerate(plan.commands):
+            if index < start:
+                # pipette settings from the finished part of the run still apply, on the robot and in the trace
+                if isinstance(command, Setting):
+                    apply_setting(pipettes[command.pipette], command)
+                    if trace is not None:
+                        trace.skipped(command)
+                continue
+            ledger.begin(command)
+            journal.record(index, 'start')
+            started = trace.now() if trace is not None else 0
+            began = time.monotonic()
+            idle = began - worked if not protocol.is_simulating() else 0
+            run_command(protocol, command, labware, pipettes, notifier, idle)
+            if not isinstance(command, (Pause, Delay, Setting)):
+                worked = time.monotonic()
+            if trace is not None:
+                trace.command(index, command, started, trace.now())
+            ledger.record(command, time.monotonic() - began)
+            journal.record(index, 'done')
+        status = 'complete'
+    finally:
+        # also written when the run stops part way, up to where it stopped
+        if trace is not None:
+            trace.write(trace_file)
+        ledger.close(status)
+        journal.close()
+    if trace_file and protocol.is_simulating():
+        estimated_trace(plan).write(trace_file)
+
+    notifier.notify('Protocol complete.')
+    notifier.close()
@@ -0,0 +1,99 @@
+# progress journal - records each command as it starts and finishes, so a stopped run can resume at the first unfinished command
+import hashlib
+import json
+import os
+from dataclasses import asdict
+
+from .commands import Transfer, Distribute, Pause, Tip, tips_used, moves
+
+
+# hash of everything the robot will do; a journal only applies to the exact same command stream
+def plan_hash(plan):
+    data = {
+        'deck': asdict(plan.deck),
+        'commands': [[type(command).__name__, asdict(command)] for command in plan.commands],
+        }
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+class Journal:
+    def __init__(self, directory, plan, enabled=True):
+        self.path = os.path.join(directory, plan_hash(plan) + '.jsonl') if directory else None
+        self.enabled = enabled and self.path is not None
+        self.file = None
+
+    # index -> 'start' or 'done' for every command the journal has seen
+    def read(self):
+        events = {}
+        if self.path and os.path.exists(self.path):
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        break # a line cut short when the robot stopped
+                    if events.get(entry['index']) != 'done':
+                        events[entry['index']] = entry['event']
+        return events
+
+    def record(self, index, event):
+        if not self.enabled:
+            return
+        if self.file is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.file = open(self.path, 'a')
+        self.file.write(json.dumps({'index': index, 'event': event}) + '\n')
+        # flushed each time, which is enough when the run is stopped or the software crashes; only a finished command is also
+        # synced to the disk, so a power cut at worst forgets that the command after it had started (it is then run again as if
+        # it hadn't)
+        self.file.flush()
+        if event == 'done':
+            os.fsync(self.file.fileno())
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+# where to pick up a stopped run: the first command not finished, and whether it was started (its tips may be used, its liquid partly moved)
+def resume_point(events, commands):
+    for index in range(len(commands)):
+        if events.get(index) != 'done':
+            return index, events.get(index) == 'start'
+    return len(commands), False
+
+
+# tips used on each pipette since its racks were last filled, up to the resume point; an interrupted command's tips count as used
+def tips_taken(commands, resume_index, interrupted):
+    taken = {}
+    last = resume_index + 1 if interrupted else resume_index
+    for command in commands[:last]:
+        if isinstance(command, Pause):
+            for pipette in command.replace_tips:
+                taken[pipette] = 0
+        elif isinstance(command, (Transfer, Distribute, Tip)):
+            taken[command.pipette] = taken.get(command.pipette, 0) + tips_used(command)
+    return taken
+
+
+# uL in each tube after the commands before the resume point
+def liquid_volumes(commands, resume_index):
+    volumes = {}
+    for command in commands[:resume_index]:
+        for source, dest, volume in moves(command):
+            volumes[source] = volumes.get(source, 0) - volume
+            volumes[dest] = volumes.get(dest, 0) + volume
+    return volumes
+
+
+# pick_up_tip commands before the resume point whose drop_tip comes after it - the pipette lost that tip when the run stopped
+def open_tip_pickups(commands, resume_index):
+    held = {}
+    for index, command in enumerate(commands[:resume_index]):
+        if isinstance(command, Tip):
+            if command.action == 'pick_up':
+                held[command.pipette] = index
+            else:
+                held.pop(command.pipette, None)
+    return sorted(held.values())
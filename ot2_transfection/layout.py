@@ -0,0 +1,137 @@
+# deck layout optimizer - puts the labware in the slots that give the least travel for the plan's own transfers
+import functools
+
+from .commands import Transfer, Distribute, Pause, Tip, distribute_fills, transfer_volumes
+from .deck import tuberack_model, plate_model, pipette_specs, bulk_models, tips_per_rack
+from .timing import slot_xy, trash_slot
+
+deck_slots = [str(slot) for slot in range(1, 12)] # slot 12 is the trash
+
+
+# where labware goes, as load_labware would be called for it: [{'name', 'model', 'slot'}, ...]; tip racks also carry their pipette
+def load_labware_config(deck):
+    config = [{'name': 'tuberack' + rack, 'model': tuberack_model, 'slot': slot} for rack, slot in sorted(deck.tuberack_slots.items())]
+    config += [{'name': 'plate' + plate, 'model': plate_model, 'slot': slot} for plate, slot in sorted(deck.plate_slots.items())]
+    if deck.bulk_source:
+        config.append({'name': 'bulk', 'model': bulk_models[deck.bulk_source][0], 'slot': deck.bulk_slot})
+    for pipette, slots in deck.tip_rack_slots.items():
+        config += [{'name': pipette + ' tips ' + str(number + 1), 'model': pipette_specs[pipette]['tip_rack'], 'slot': slot, 'pipette': pipette} for number, slot in enumerate(slots)]
+    return config
+
+
+# the labware the robot visits, in order, to run the commands; tips are taken from the racks in order and start again from the first rack after a replacement
+def labware_visits(commands):
+    visits = []
+    taken = {pipette: 0 for pipette in pipette_specs}
+
+    def pick_up(pipette):
+        visits.append(pipette + ' tips ' + str(taken[pipette] // tips_per_rack + 1))
+        taken[pipette] += 1
+
+    for command in commands:
+        if isinstance(command, Transfer):
+            for _ in transfer_volumes(command.volume, pipette_specs[command.pipette]['max_volume']):
+                if command.new_tip == 'always':
+                    pick_up(command.pipette)
+                visits += [command.source[0], command.dest[0]]
+                if command.new_tip == 'always':
+                    visits.append('trash')
+        elif isinstance(command, Distribute):
+            pick_up(command.pipette)
+            for fill in distribute_fills(command):
+                visits += [command.source[0]] + [dest[0] for dest, _ in fill] + [command.source[0]]
+            visits.append('trash')
+        elif isinstance(command, Tip):
+            if command.action == 'pick_up':
+                pick_up(command.pipette)
+            else:
+                visits.append('trash')
+        elif isinstance(command, Pause):
+            for pipette in command.replace_tips:
+                taken[pipette] = 0
+    return visits
+
+
+# moves between each pair of labware
+def traffic_matrix(commands):
+    traffic = {}
+    visits = labware_visits(commands)
+    for here, there in zip(visits, visits[1:]):
+        if here != there:
+            traffic[(here, there)] = traffic.get((here, there), 0) + 1
+    return traffic
+
+
+def distance(slot, other):
+    (x, y), (other_x, other_y) = slot_xy(slot), slot_xy(other)
+    return ((x - other_x)**2 + (y - other_y)**2) ** 0.5
+
+
+def layout_cost(traffic, slots):
+    return sum(moves * distance(slots[here], slots[there]) for (here, there), moves in traffic.items())
+
+
+# labware name -> slot for everything on the deck
+def deck_assignment(deck):
+    slots = {item['name']: item['slot'] for item in load_labware_config(deck)}
+    slots['trash'] = trash_slot
+    return slots
+
+
+# move labware between slots, or into empty ones, while any single swap shortens the total travel; the trash stays in slot 12
+def search_layout(traffic, slots):
+    cost = layout_cost(traffic, slots)
+    movable = [name for name in slots if name != 'trash']
+    while True:
+        best = None
+        for name in movable:
+            for slot in deck_slots:
+                if slot == slots[name]:
+                    continue
+                other = next((other for other in movable if slots[other] == slot), None)
+                trial = dict(slots)
+                trial[name] = slot
+                if other is not None:
+                    trial[other] = slots[name]
+                trial_cost = layout_cost(traffic, trial)
+                if trial_cost < cost - 1e-6 and (best is None or trial_cost < best[0]):
+                    best = (trial_cost, trial)
+        if best is None:
+            return cost, slots
+        cost, slots = best
+
+
+# the search for a traffic matrix and starting slots, kept for the last few: an edited plate map whose transfers visit the labware
+# as before skips the search. Bounded, as a long-running process (the planning service) plans many maps
+@functools.lru_cache(maxsize=128)
+def cached_layout(traffic, slots):
+    cost, slots = search_layout(dict(traffic), dict(slots))
+    return cost, tuple(sorted(slots.items()))
+
+
+# lay the deck out for the least travel (search_layout), and write the slots back to it; returns the total travel
+def optimize_layout(deck, commands):
+    cost, slots = cached_layout(tuple(sorted(traffic_matrix(commands).items())), tuple(sorted(deck_assignment(deck).items())))
+    slots = dict(slots)
+
+    for rack in deck.tuberack_slots:
+        deck.tuberack_slots[rack] = slots['tuberack' + rack]
+    for plate in deck.plate_slots:
+        deck.plate_slots[plate] = slots['plate' + plate]
+    for pipette, racks in deck.tip_rack_slots.items():
+        deck.tip_rack_slots[pipette] = [slots[pipette + ' tips ' + str(number + 1)] for number in range(len(racks))]
+    if deck.reagent_rack_slot is not None:
+        deck.reagent_rack_slot = deck.tuberack_slots['4']
+    if deck.bulk_source:
+        deck.bulk_slot = slots['bulk']
+    deck.free_slots = [slot for slot in deck_slots if slot not in slots.values()]
+    return cost
+
+
+# the deck as the operator sees it, back row first
+def print_deck_layout(deck):
+    names = {item['slot']: item['name'] for item in load_labware_config(deck)}
+    names[trash_slot] = 'trash'
+    print('Deck layout:')
+    for row in ([10, 11, 12], [7, 8, 9], [4, 5, 6], [1, 2, 3]):
+        print('  ' + ''.join((str(slot).rjust(2) + ' ' + names.get(str(slot), '.')).ljust(18) for slot in row))
@@ -0,0 +1,160 @@
+# run ledger - a local SQLite history of each real run: its plan, plate map, the reagents loaded, the tips each rack type gave
+# and how long each step took, for throughput and cost trends. Writes are held back to the step boundaries, one transaction
+# per step, so the motion commands never wait on the disk
+#   python -m ot2_transfection ledger --by month --price L3000=1.2
+import datetime
+import os
+import sqlite3
+import time
+
+from .commands import Transfer, Distribute, Pause, Delay, Tip, steps, tips_used
+from .deck import pipette_specs, reagent_load_volumes
+from .journal import plan_hash
+
+schema = '''
+create table if not exists runs (id integer primary key, plan_hash text, started real, finished real, status text, resumed_at integer,
+    transfections integer, DNA_transfers integer, plate_wells integer, OM_MM_vol real, P3K_MM_vol real, L3K_MM_vol real);
+create table if not exists reagents (run integer, reagent text, uL real);
+create table if not exists steps (run integer, step text, robot_seconds real, wait_seconds real, commands integer);
+create table if not exists tips (run integer, step text, pipette text, tip_rack text, tips integer);
+'''
+
+
+class Ledger:
+    def __init__(self, path, plan, enabled=True):
+        self.path = path
+        self.plan = plan
+        self.enabled = enabled and path is not None
+        self.db = None
+        self.run = None
+        self.step = None # the step being run, and what it has used so far
+        self.robot_seconds = self.wait_seconds = 0
+        self.commands = 0
+        self.tips = {}
+
+    # the run, its plate map and the reagents the master mix calculations load, written before the robot moves
+    def start(self, resumed_at=0):
+        if not self.enabled:
+            return
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self.db = sqlite3.connect(self.path)
+        self.db.executescript(schema)
+        plan = self.plan
+        with self.db:
+            self.run = self.db.execute('insert into runs (plan_hash, started, status, resumed_at, transfections, DNA_transfers, plate_wells, OM_MM_vol, P3K_MM_vol, L3K_MM_vol) '
+                'values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', (plan_hash(plan), time.time(), 'running', resumed_at, len(plan.groups), len(plan.entries),
+                len(plan.plate_transfers), plan.OM_MM_vol, plan.P3K_MM_vol, plan.L3K_MM_vol)).lastrowid
+            self.db.executemany('insert into reagents values (?, ?, ?)', [(self.run, reagent, uL) for reagent, uL in reagent_volumes(plan).items()])
+
+    # before each command; one that starts a new step writes the step before it
+    def begin(self, command):
+        if self.enabled and command.step != self.step:
+            self.flush()
+            self.step = command.step
+
+    # after each command, with the seconds it took; pauses and delays are time the robot waits
+    def record(self, command, seconds):
+        if not self.enabled:
+            return
+        self.commands += 1
+        if isinstance(command, (Pause, Delay)):
+            self.wait_seconds += seconds
+        else:
+            self.robot_seconds += seconds
+        if isinstance(command, (Transfer, Distribute, Tip)) and tips_used(command):
+            self.tips[command.pipette] = self.tips.get(command.pipette, 0) + tips_used(command)
+
+    def flush(self):
+        if self.step is None or not self.commands:
+            return
+        with self.db:
+            self.db.execute('insert into steps values (?, ?, ?, ?, ?)', (self.run, self.step, self.robot_seconds, self.wait_seconds, self.commands))
+            self.db.executemany('insert into tips values (?, ?, ?, ?, ?)', [(self.run, self.step, pipette, pipette_specs[pipette]['tip_rack'], tips)
+                for pipette, tips in self.tips.items()])
+        self.robot_seconds = self.wait_seconds = 0
+        self.commands = 0
+        self.tips = {}
+
+    # the last step and how the run ended: 'complete', or 'stopped' part way
+    def close(self, status):
+        if self.db is None:
+            return
+        self.flush()
+        with self.db:
+            self.db.execute('update runs set finished = ?, status = ? where id = ?', (time.time(), status, self.run))
+        self.db.close()
+        self.db = None
+
+
+# uL of each reagent the operator loads; the Opti-MEM refill tube counts as Opti-MEM, and the empty tubes are left out
+def reagent_volumes(plan):
+    volumes = {}
+    for name, uL in reagent_load_volumes(plan).items():
+        name = 'Opti-MEM' if name == 'Opti-MEM 2' else name
+        if uL:
+            volumes[name] = volumes.get(name, 0) + uL
+    return volumes
+
+
+# the period a run started in: '2024-05-17', '2024-W20' or '2024-05'
+def period(started, by):
+    date = datetime.date.fromtimestamp(started)
+    if by == 'day':
+        return date.isoformat()
+    if by == 'week':
+        year, week, _ = date.isocalendar()
+        return str(year) + '-W' + str(week).zfill(2)
+    return date.isoformat()[:7]
+
+
+# runs, throughput, tips and reagent cost per period, oldest first; prices are per uL of each reagent (see sweep.default_prices)
+def ledger_trends(path, by='week', since=None, prices=None):
+    db = sqlite3.connect(path)
+    db.executescript(schema)
+    prices = prices or {}
+    since = datetime.datetime.fromisoformat(since).timestamp() if since else 0
+    periods = {}
+    for run, started, finished, status, transfections, wells in db.execute('select id, started, finished, status, transfections, plate_wells from runs where started >= ? order by started', (since,)):
+        trend = periods.setdefault(period(started, by), {'period': period(started, by), 'runs': 0, 'completed': 0, 'transfections': 0, 'plate_wells': 0,
+            'run_hours': 0, 'step_minutes': {step: 0 for step in steps}, 'tips': {}, 'reagents_uL': {}, 'reagent_cost': 0})
+        trend['runs'] += 1
+        if status != 'complete':
+            continue # a stopped run used tips and reagents but didn't deliver its plate map
+        trend['completed'] += 1
+        trend['transfections'] += transfections
+        trend['plate_wells'] += wells
+        trend['run_hours'] += (finished - started) / 3600
+        for step, seconds in db.execute('select step, robot_seconds + wait_seconds from steps where run = ?', (run,)):
+            trend['step_minutes'][step] = trend['step_minutes'].get(step, 0) + seconds / 60
+        for tip_rack, tips in db.execute('select tip_rack, sum(tips) from tips where run = ? group by tip_rack', (run,)):
+            trend['tips'][tip_rack] = trend['tips'].get(tip_rack, 0) + tips
+        for reagent, uL in db.execute('select reagent, uL from reagents where run = ?', (run,)):
+            trend['reagents_uL'][reagent] = trend['reagents_uL'].get(reagent, 0) + uL
+            trend['reagent_cost'] += uL * prices.get(reagent, 0)
+    db.close()
+
+    trends = list(periods.values())
+    for trend in trends:
+        trend['transfections_per_hour'] = round(trend['transfections'] / trend['run_hours'], 1) if trend['run_hours'] else None
+        trend['run_hours'] = round(trend['run_hours'], 2)
+        trend['step_minutes'] = {step: round(minutes, 1) for step, minutes in trend['step_minutes'].items()}
+        trend['reagents_uL'] = {reagent: round(uL, 1) for reagent, uL in trend['reagents_uL'].items()}
+        trend['reagent_cost'] = round(trend['reagent_cost'], 2)
+        trend['cost_per_transfection'] = round(trend['reagent_cost'] / trend['transfections'], 3) if trend['transfections'] else None
+    return trends
+
+
+def print_trends(trends):
+    if not trends:
+        print('no runs in the ledger')
+        return
+    tip_racks = sorted(set(tip_rack for trend in trends for tip_rack in trend['tips']))
+    reagents = sorted(set(reagent for trend in trends for reagent in trend['reagents_uL']))
+    columns = [('period', 12), ('runs', 6), ('done', 6), ('transf.', 9), ('hours', 7), ('transf./h', 10)] + \
+        [(tip_rack.rsplit('_', 1)[-1] + ' tips', 12) for tip_rack in tip_racks] + [(reagent + ' uL', 13) for reagent in reagents] + [('cost', 9), ('per transf.', 11)]
+    print(''.join(name.ljust(width) for name, width in columns))
+    for trend in trends:
+        cells = [trend['period'], str(trend['runs']), str(trend['completed']), str(trend['transfections']), str(trend['run_hours']), str(trend['transfections_per_hour'] or '-')] + \
+            [str(trend['tips'].get(tip_rack, 0)) for tip_rack in tip_racks] + [str(trend['reagents_uL'].get(reagent, 0)) for reagent in reagents] + \
+            [str(trend['reagent_cost']), str(trend['cost_per_transfection'] or '-')]
+        print(''.join(cell.ljust(width) for cell, (_, width) in zip(cells, columns)))
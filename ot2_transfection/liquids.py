@@ -0,0 +1,45 @@
+# liquid classes - how each liquid is pipetted: speeds, waits in the liquid, blow out and touch tip
+from dataclasses import dataclass, field
+
+
+@dataclass
+class LiquidClass:
+    name: str
+    aspirate_flow_rate: dict = field(default_factory=dict) # uL/sec per pipette, e.g. {'p300': 250, 'p20': 20}
+    dispense_flow_rate: dict = field(default_factory=dict)
+    aspirate_delay: float = 0 # sec to wait in the liquid after aspirating, so a viscous liquid finishes coming up the tip
+    dispense_delay: float = 0 # sec to wait after dispensing, so it finishes running down the tip
+    blow_out: bool = True # blow out at the top of the destination after each dispense
+    touch_tip: bool = False # touch the tip to the tube wall after aspirating and after dispensing
+
+
+# tuned for 1.5 mL tubes and a 24-well plate. The aqueous liquids (DNA, Opti-MEM, the Opti-MEM-based complexes and cells) keep
+# v3.8's speeds - 250 uL/sec on the p300, 20 on the p20, 500 on the p1000, and the 50 uL/sec plate dispense for the cells - with
+# no waits, so they cost no time; only the viscous lipid reagents are slowed down and given time in the liquid. touch_tip is off
+# everywhere: it adds two wall touches to every tip-full, so turn it on for a class only where droplets on the tip are a problem
+aqueous_flow_rate = {'p300': 250, 'p20': 20, 'p1000': 500}
+default_liquid_classes = {
+    'aqueous DNA': LiquidClass('aqueous DNA', dict(aqueous_flow_rate), dict(aqueous_flow_rate)),
+    'Opti-MEM': LiquidClass('Opti-MEM', dict(aqueous_flow_rate), dict(aqueous_flow_rate)),
+    'P3000': LiquidClass('P3000', {'p300': 100, 'p20': 7.5, 'p1000': 250}, {'p300': 100, 'p20': 7.5, 'p1000': 250}, aspirate_delay=1, dispense_delay=0.5),
+    'Lipofectamine 3000': LiquidClass('Lipofectamine 3000', {'p300': 50, 'p20': 3.5, 'p1000': 150}, {'p300': 50, 'p20': 3.5, 'p1000': 150}, aspirate_delay=2, dispense_delay=1),
+    'lipid-DNA complex': LiquidClass('lipid-DNA complex', dict(aqueous_flow_rate), dict(aqueous_flow_rate)),
+    'cell addition': LiquidClass('cell addition', dict(aqueous_flow_rate), {'p300': 50, 'p20': 20, 'p1000': 50}), # slow dispense to not disturb the monolayer
+    }
+
+
+# a LiquidClass from a dict of its fields (the name defaults to the class's key), e.g. {'aspirate_flow_rate': {'p300': 100}}
+def as_liquid_class(name, liquid):
+    if isinstance(liquid, LiquidClass):
+        return liquid
+    if not isinstance(liquid, dict):
+        raise TypeError('liquid class ' + repr(name) + ' must be a LiquidClass or a dict of its fields, not ' + type(liquid).__name__)
+    unknown = [field for field in liquid if field not in LiquidClass.__dataclass_fields__]
+    if unknown:
+        raise TypeError('liquid class ' + repr(name) + ' has unknown field(s) ' + ', '.join(repr(field) for field in unknown) + '; see LiquidClass in ot2_transfection/liquids.py')
+    return LiquidClass(**dict({'name': name}, **liquid))
+
+
+# the class a transfer is pipetted with, None if the settings don't have one for it (then the pipette's own flow rates are used)
+def liquid_class(settings, name):
+    return settings.liquid_classes.get(name)
@@ -0,0 +1,65 @@
+# operator notifications - sound on the OT-2 speaker and an optional status file/socket, sent from a background thread
+# so the motion commands never wait for a sound clip to finish
+import json
+import os
+import queue
+import socket
+import subprocess
+import threading
+import time
+
+AUDIO_FILE_PATH = '/etc/audio/speaker-test.mp3'
+
+
+class Notifier:
+    def __init__(self, sound=True, status_file=None, status_address=None, enabled=True):
+        self.sound = sound
+        self.status_file = status_file
+        self.status_address = status_address # 'host:port' to send each status to as a UDP datagram
+        self.queue = queue.Queue()
+        self.thread = None
+        if enabled and (sound or status_file or status_address):
+            self.thread = threading.Thread(target=self.worker, name='ot2-notify', daemon=True)
+            self.thread.start()
+
+    # queue a notification and return straight away; does nothing when disabled (e.g. in simulation)
+    def notify(self, message, sound=True):
+        if self.thread is not None:
+            self.queue.put({'time': time.time(), 'message': message, 'sound': sound})
+
+    # let queued notifications finish, waiting at most timeout seconds
+    def close(self, timeout=10):
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join(timeout)
+            self.thread = None
+
+    def worker(self):
+        while True:
+            status = self.queue.get()
+            if status is None:
+                return
+            # a notification that fails must never stop the run
+            try:
+                self.publish(status)
+            except Exception as error:
+                print('Notification failed:', error)
+
+    def publish(self, status):
+        text = json.dumps({'time': status['time'], 'message': status['message']})
+        if self.status_file:
+            # write the latest status to a temporary file and swap it in, so anything polling the file never reads half a line
+            with open(self.status_file + '.tmp', 'w') as f:
+                f.write(text + '\n')
+            os.replace(self.status_file + '.tmp', self.status_file)
+        if self.status_address:
+            host, _, port = self.status_address.rpartition(':')
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sender:
+                sender.sendto(text.encode(), (host, int(port)))
+        if self.sound and status['sound']:
+            subprocess.run(['mpg123', '-q', AUDIO_FILE_PATH], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+# notifier for a run; a no-op while the protocol is simulated or analysed
+def notifier_for(protocol, settings):
+    return Notifier(settings.notify_sound, settings.status_file, settings.status_address, enabled=not protocol.is_simulating())
@@ -0,0 +1,79 @@
+# command optimizer - drops mixes and blow outs that a later operation on the same tube makes pointless, and reports the time saved
+from dataclasses import replace
+
+from .commands import Transfer, Distribute, Tip, transfer_volumes, steps
+from .deck import pipette_specs
+from .timing import step_seconds
+
+
+# a transfer pipette.transfer() would split into several tips, one Transfer per tip; each keeps its mix so the later pass can drop all but the last
+def split_mixed_transfers(commands):
+    split = []
+    for command in commands:
+        volumes = transfer_volumes(command.volume, pipette_specs[command.pipette]['max_volume']) if isinstance(command, Transfer) else [0]
+        if len(volumes) == 1 or command.new_tip != 'always' or not command.mix_after[0]:
+            split.append(command)
+            continue
+        for number, volume in enumerate(volumes):
+            split.append(replace(command, label=command.label + ' (' + str(number + 1) + '/' + str(len(volumes)) + ')', volume=volume))
+    return split
+
+
+# a mix_after is redundant when the next operation on the tube mixes it again at least as hard, before anything is taken out of it
+def mix_superseded(command, later):
+    for other in later:
+        if isinstance(other, Distribute):
+            if other.source == command.dest:
+                return other.mix_before[0] >= command.mix_after[0] and other.mix_before[1] >= command.mix_after[1]
+            if any(dest == command.dest for dest, _ in other.dests):
+                return False
+        if not isinstance(other, Transfer):
+            continue
+        if other.dest == command.dest:
+            return other.mix_after[0] >= command.mix_after[0] and other.mix_after[1] >= command.mix_after[1]
+        if other.source == command.dest:
+            return other.mix_before[0] >= command.mix_after[0] and other.mix_before[1] >= command.mix_after[1]
+    return False
+
+
+# a blow out is redundant only when the same tip goes on to the same source and destination (the strokes of plan_strokes):
+# what it would blow out then reaches the destination with the next stroke, and is blown out there after the last. Anything else -
+# a new tip, another destination, or a mix that leaves the destination's mixture in the tip - loses or carries over the
+# residue, so the blow out stays
+def blow_out_superseded(command, later):
+    if command.new_tip != 'never' or command.mix_after[0]:
+        return False
+    for other in later:
+        if isinstance(other, Tip) and other.pipette == command.pipette:
+            return False
+        if isinstance(other, (Transfer, Distribute)) and other.pipette == command.pipette:
+            return isinstance(other, Transfer) and other.new_tip == 'never' and other.source == command.source and other.dest == command.dest
+    return False
+
+
+# returns the optimized commands and, per step, how many mixes and blow outs were dropped and the estimated seconds saved
+def optimize_commands(commands, deck, settings):
+    optimized = split_mixed_transfers(commands) if settings.skip_redundant_mixes else list(commands)
+    report = {step: {'mixes': 0, 'blow_outs': 0, 'seconds': 0} for step in steps}
+    for index, command in enumerate(optimized):
+        if not isinstance(command, Transfer):
+            continue
+        if settings.skip_redundant_mixes and command.mix_after[0] and mix_superseded(command, optimized[index+1:]):
+            command = optimized[index] = replace(command, mix_after=(0,0))
+            report[command.step]['mixes'] += 1
+        if settings.skip_redundant_blow_outs and command.blow_out and (command.liquid is None or command.liquid.blow_out) and blow_out_superseded(command, optimized[index+1:]):
+            optimized[index] = replace(command, blow_out=False)
+            report[command.step]['blow_outs'] += 1
+
+    before = step_seconds(commands, deck)
+    after = step_seconds(optimized, deck)
+    for step in steps:
+        report[step]['seconds'] = before[step] - after[step]
+    return optimized, report
+
+
+def print_optimizer_report(report):
+    print('Optimizer - dropped mixes and blow outs, and the estimated time saved:')
+    for step, saved in report.items():
+        print('  ' + step.ljust(15) + str(saved['mixes']).rjust(3) + ' mixes, ' + str(saved['blow_outs']).rjust(3) + ' blow outs, ' + str(round(saved['seconds'])).rjust(4) + ' sec')
+    print('  total'.ljust(17) + str(round(sum(saved['seconds'] for saved in report.values()))).rjust(28) + ' sec')
@@ -0,0 +1,460 @@
+# planning - turns the plate map csv into the volumes and groups the protocol pipettes
+import csv
+import hashlib
+import math
+import os
+from dataclasses import dataclass, field
+
+from .liquids import default_liquid_classes, as_liquid_class
+
+
+# transfection parameters and feature flags - every experiment entry point builds one of these
+@dataclass
+class Settings:
+    OM: float = 0.05 # uL of Opti-MEM per ng of DNA
+    P3K: float = 0.0022 # uL of P3000 per ng of DNA
+    L3K: float = 0.0022 # uL of L3000 per ng of DNA
+    Excess: float = 1.2 # excess multiplier for pipetting error
+    MM_excess: float = 1.2 # extra excess on the master mixes (v3.2 ran without it, 1.0)
+
+    # feature flags, named after the script version that introduced them
+    consolidate_replicates: bool = True # v3.3: rows with the same DNA source and destination share one transfer
+    mix_cotransfections: bool = True # v3.6: mix a co-transfection tube after its last DNA is added
+    mix_source_once: bool = True # v3.8: only mix a DNA source tube the first time it is used
+    separate_L3K_pause: bool = True # v3.3: ask for L3000 at its own pause instead of with OM/P3000
+
+    # pipetting heights (mm from the bottom of the tube/well) and speeds (uL/sec)
+    DNA_aspirate_clearance: float = 0.1 # Step 1 (0.5 before v3.7)
+    aspirate_clearance: float = 0.5
+    dispense_clearance: float = 0.5
+    plate_dispense_clearance: float = 2 # Step 3; high enough not to touch the cells
+    p300_flow_rate: float = 250
+    p20_flow_rate: float = 20
+    plate_dispense_flow_rate: float = 50 # Step 3; slower to not disturb monolayer
+    p1000_flow_rate: float = 500
+
+    # pipettes and the Opti-MEM source: p1000_mount='left' or 'right' mounts a p1000 in place of the p20 or p300 there, and
+    # every volume it takes in fewer strokes (the Opti-MEM draws) goes to it. OM_source='reservoir' (NEST 12-well, well A1) or
+    # 'conical' (4x50/6x15 mL rack, a 50 mL tube in A3) takes the Opti-MEM from there instead of 1.5 mL tubes
+    p1000_mount: str = None
+    OM_source: str = 'tube'
+
+    # liquid classes by name (see liquids.py); each transfer is pipetted with its liquid's speeds, delays and blow out instead of
+    # the flow rates above. Set to {} to pipette everything with the flow rates above and a blow out, as v3.8 did
+    liquid_classes: dict = field(default_factory=lambda: dict(default_liquid_classes))
+
+    # DNA multi-dispense: one tip per DNA source and pipette, dispensing above the liquid into every destination it can (off: one
+    # tip per DNA transfer); the height comes from the liquid each destination ends up with (see commands.liquid_height)
+    multi_dispense_DNA: bool = False
+
+    # co-transfection premixes: helper plasmids that several co-transfections share at the same ratio are pooled into one
+    # tube first and pipetted from there, one transfer per co-transfection instead of one per helper
+    premix_cotransfections: bool = False
+
+    # DNA too concentrated to pipette (under pipette_min uL) is diluted on the deck at the start of Step 1 instead of halting:
+    # diluent into an empty tube, then the stock, and those transfers draw from the dilution. diluent is 'water' (a tube of its
+    # own, on the deck with the DNA) or 'Opti-MEM' (from the Opti-MEM, which then has to be on the deck from the start)
+    predilute_DNA: bool = True
+    diluent: str = 'water'
+    dilution_min_draw: float = 2 # uL; the smallest of dilution_factors that gets every transfer from a source to this is used
+
+    # bulk transfers (more than one p300 tip-full, e.g. Opti-MEM into the master mixes) in equal strokes on one tip, mixing only
+    # after the last (see plan_strokes in commands.py); off: pipette.transfer() takes a new tip, and mixes, for each tip-full
+    plan_strokes: bool = False
+
+    # deck layout optimizer (see layout.py): move the tube racks, plates and tip racks to the slots with the least travel for
+    # this plan; off keeps tube racks in 4/5/6, plates in 2/3 and tip racks in 9/8
+    optimize_layout: bool = False
+
+    # command optimizer (see optimize.py)
+    skip_redundant_mixes: bool = True # drop a mix when the next operation on the tube mixes it again anyway
+    skip_redundant_blow_outs: bool = True # drop the blow out between strokes of one tip into the same tube (see plan_strokes)
+
+    # operator pauses: load every reagent before the run instead of at the "get OM and P3000" and "get L3000" pauses (they are left
+    # out unless tip racks have to be swapped there), and have the robot time the incubation before plate addition
+    minimize_pauses: bool = False
+    cells_up_front: bool = False # the cell plates are on the deck from the start as well, so the incubation needs no pause either
+    incubation_minutes: float = 10
+
+    # operator notifications at each pause and at the end of the run (see notify.py)
+    notify_sound: bool = True # play a sound on the OT-2 speaker
+    status_file: str = None # file that always holds the latest status, e.g. '/data/transfection_status.json'
+    status_address: str = None # 'host:port' that gets each status as a UDP datagram
+
+    # progress journal (see journal.py); set resume=True to continue a stopped run of the same plan where it stopped
+    journal_dir: str = '/data/user_storage/transfection_journal'
+    resume: bool = False
+
+    # history of real runs - plate map, reagents, tips and step times - for `python -m ot2_transfection ledger` (see ledger.py);
+    # None to keep none
+    ledger_file: str = '/data/user_storage/transfection_ledger.db'
+
+    # timeline of the run as Chrome trace JSON (see trace.py), e.g. '/data/user_storage/transfection_trace.json'; timed on the robot,
+    # estimated when simulated
+    trace_file: str = None
+
+    # fixed reagent tube positions, e.g. {'OM/L3K MM': 'D1.3', ...}; leave empty to let the deck allocator pick them
+    reagent_positions: dict = field(default_factory=dict)
+
+    # liquid classes given as plain dicts (from --set or the planning service's JSON) become LiquidClass objects here, so a bad
+    # one is rejected when the settings are made rather than part way through a run
+    def __post_init__(self):
+        self.liquid_classes = {name: as_liquid_class(name, liquid) for name, liquid in self.liquid_classes.items()}
+
+
+# reagent tube positions the scripts used before the allocator (tuberack3 D1-D6)
+legacy_reagent_positions = {'OM/L3K MM': 'D1.3', 'OM/P3K MM': 'D2.3', 'L3000': 'D3.3', 'P3000': 'D4.3', 'Opti-MEM 2': 'D5.3', 'Opti-MEM': 'D6.3'}
+
+
+# one csv row, with its volumes worked out
+@dataclass
+class Row:
+    line: int # line in the csv, so errors can point at the row to fix
+    DNA_source: str
+    DNA_dest: str
+    L3K_dest: str
+    plate_dest: str
+    transfection_type: str
+    name: str
+    uL_DNA: float = 0
+    uL_OM: float = 0
+    uL_P3K: float = 0
+    uL_L3K: float = 0
+    readable: bool = True # False if its numbers couldn't be read; the row is already reported and isn't checked further
+
+
+# one Step 1 DNA transfer; technical replicates (same source and destination) are combined into one
+@dataclass
+class Entry:
+    line: int
+    DNA_source: str
+    DNA_dest: str
+    L3K_dest: str
+    transfection_type: str
+    name: str
+    uL_DNA: float = 0
+    uL_OM: float = 0
+    uL_P3K: float = 0
+    uL_L3K: float = 0
+
+
+# the entries that share one DNA tube and one L3K/OM MM tube in Step 2 (several for a co-transfection)
+@dataclass
+class Group:
+    entries: list
+    DNA_dest: str
+    L3K_dest: str
+    OM_P3K_MM_vol: float = 0
+    OM_L3K_MM_vol: float = 0
+    mixing_vol: float = 0
+
+
+# DNA sources pooled into one tube for several co-transfections; each part is a (DNA source, uL) pipetted into it
+@dataclass
+class Premix:
+    name: str # reagent tube name, e.g. 'DNA mix 1'; the entries that take from it use it as their DNA source
+    parts: list
+    groups: list
+
+
+# a DNA source too concentrated to pipette, diluted on the deck; the entries that take from it use its name as their DNA source
+@dataclass
+class Dilution:
+    name: str # reagent tube name, e.g. 'Dilution 1'
+    source: str # csv tube
+    factor: float
+    stock: float # uL of DNA
+    diluent: float # uL of water or Opti-MEM
+    entries: list
+
+
+# one Step 3 transfer of transfection mix into a plate well
+@dataclass
+class PlateTransfer:
+    rows: list
+    source: str # L3K/OM MM tube
+    plate_dest: str
+    transfection_vol: float = 0
+
+
+@dataclass
+class Plan:
+    settings: Settings
+    rows: list
+    entries: list
+    groups: list
+    plate_transfers: list
+    errors: list # problems found while reading the csv
+    OM_MM_vol: float = 0
+    P3K_MM_vol: float = 0
+    L3K_MM_vol: float = 0
+    OM_refill: bool = False # one tube can't hold the Opti-MEM for both master mixes, so a second tube tops it up
+
+    # filled in by prepare()
+    deck: object = None
+    commands: list = None
+    warnings: list = field(default_factory=list)
+    tip_demand: list = None
+    premixes: list = field(default_factory=list)
+    dilutions: list = field(default_factory=list)
+    optimizer_report: dict = None # per step: mixes and blow outs dropped, estimated seconds saved
+
+    # filled in by plan_with_changes(): DNA destinations of the transfections that are new or changed since the previous plan, and of those gone
+    changed: list = None
+    removed: list = None
+
+
+tube_capacity = 1500 # uL that fit in a 1.5 mL Eppendorf
+pipette_min = 1 # uL; smallest volume the p20 can pipette accurately
+dilution_factors = [2, 5, 10, 20, 50, 100]
+tube_wells = [row + str(column) for row in 'ABCD' for column in range(1,7)] # same wells on the tube racks and the 24-well plates
+csv_tuberacks = ['1', '2', '3'] # rack and plate numbers a csv location can name (deck.Deck puts them in slots 4-6 and 2-3)
+csv_plates = ['1', '2']
+
+# csv columns; headers are matched ignoring case, spacing and a byte order mark, so LIMS exports read as they are
+csv_columns = ['DNA source', 'DNA destination', 'L3K/OM MM destination', 'Plate destination', 'Transfection type', 'Contents', 'Concentration (ng/uL)', 'DNA wanted (ng)']
+
+
+def valid_location(location, racks):
+    well, _, rack = location.partition('.')
+    return well in tube_wells and rack in racks
+
+
+def header_key(name):
+    return ' '.join(name.replace('\ufeff', '').split()).lower()
+
+
+# lines of the csv, one at a time: csv_source is an open file, the path of a csv file as an os.PathLike (e.g. pathlib.Path),
+# or the csv text; a str is always the text, never a file name
+def csv_lines(csv_source):
+    if hasattr(csv_source, 'read'):
+        yield from csv_source
+    elif isinstance(csv_source, os.PathLike):
+        with open(csv_source, newline='', encoding='utf-8-sig') as f:
+            yield from f
+    else:
+        start = 0 # a line at a time without copying the text
+        while start < len(csv_source):
+            end = csv_source.find('\n', start) + 1 or len(csv_source)
+            yield csv_source[start:end]
+            start = end
+
+
+# checks that need only the row itself, made as it is read: transfection type and locations
+def check_row(row, errors):
+    if row.transfection_type not in ('Single', 'Co'):
+        errors.append('line ' + str(row.line) + ': "Transfection type" must be Single or Co, not ' + repr(row.transfection_type))
+    for location, column in ((row.DNA_source, 'DNA source'), (row.DNA_dest, 'DNA destination'), (row.L3K_dest, 'L3K/OM MM destination')):
+        if not valid_location(location, csv_tuberacks):
+            errors.append('line ' + str(row.line) + ': "' + column + '" ' + repr(location) + ' is not a valid location (expected a well A1-D6, a "." and rack ' + '/'.join(csv_tuberacks) + ')')
+    if not valid_location(row.plate_dest, csv_plates):
+        errors.append('line ' + str(row.line) + ': "Plate destination" ' + repr(row.plate_dest) + ' is not a valid location (expected a well A1-D6, a "." and plate ' + '/'.join(csv_plates) + ')')
+
+
+# read the csv a row at a time and run the transfection calculations for each one; problems go to errors with their line,
+# and a row too short to read is left out
+def read_rows(csv_source, settings, errors):
+    csv_reader = csv.reader(csv_lines(csv_source))
+    header = next(csv_reader, [])
+    columns = {header_key(name): number for number, name in enumerate(header)}
+    missing = [name for name in csv_columns if header_key(name) not in columns]
+    if missing:
+        errors.append('line 1: the csv header is missing ' + ', '.join('"' + name + '"' for name in missing))
+        return
+    positions = [columns[header_key(name)] for name in csv_columns]
+    for fields in csv_reader:
+        if not fields:
+            continue
+        if len(fields) <= max(positions):
+            errors.append('line ' + str(csv_reader.line_num) + ': expected ' + str(len(header)) + ' fields, found ' + str(len(fields)))
+            continue
+        DNA_source, DNA_dest, L3K_dest, plate_dest, transfection_type, name, concentration, ng = [fields[position] for position in positions]
+        row = Row(csv_reader.line_num, DNA_source, DNA_dest, L3K_dest, plate_dest, transfection_type, name)
+        try:
+            ng_wanted = float(ng)
+            row.uL_DNA = (ng_wanted / float(concentration)) * settings.Excess
+        except (ValueError, TypeError, ZeroDivisionError):
+            errors.append('line ' + str(row.line) + ' (' + str(row.name) + '): "Concentration (ng/uL)" and "DNA wanted (ng)" must be numbers and the concentration cannot be 0')
+            ng_wanted = 0
+            row.readable = False
+        row.uL_OM = ng_wanted * settings.OM * settings.Excess
+        row.uL_P3K = ng_wanted * settings.P3K * settings.Excess
+        row.uL_L3K = ng_wanted * settings.L3K * settings.Excess
+        check_row(row, errors)
+        yield row
+
+
+# combine technical replicates into 1 master mix; returns the row's entry if it is a new one
+def consolidate(row, by_tubes, settings):
+    key = (row.DNA_source, row.DNA_dest)
+    entry = by_tubes.get(key) if settings.consolidate_replicates else None
+    new = entry is None
+    if new:
+        entry = Entry(row.line, row.DNA_source, row.DNA_dest, row.L3K_dest, row.transfection_type, row.name)
+        by_tubes[key] = entry
+    entry.uL_DNA += row.uL_DNA
+    entry.uL_OM += row.uL_OM
+    entry.uL_P3K += row.uL_P3K
+    entry.uL_L3K += row.uL_L3K
+    return entry if new else None
+
+
+# gather co-transfections into the tubes they share: an entry joins the group before it if that is a co-transfection into the
+# same tubes; co-transfection rows are expected next to each other (validate_plan checks)
+def group_entry(groups, entry):
+    last = groups[-1] if groups else None
+    if last is not None and last.entries[0].transfection_type == 'Co' and (entry.DNA_dest, entry.L3K_dest) == (last.DNA_dest, last.L3K_dest):
+        last.entries.append(entry)
+    else:
+        groups.append(Group([entry], entry.DNA_dest, entry.L3K_dest))
+
+
+# master mix and mixing volumes of a group, once replicates can't add to its entries any more
+def group_volumes(group):
+    for member in group.entries:
+        group.OM_P3K_MM_vol += member.uL_OM + member.uL_P3K
+        group.OM_L3K_MM_vol += member.uL_OM + member.uL_L3K
+        group.mixing_vol += member.uL_DNA + member.uL_OM + member.uL_P3K
+
+
+# Step 3 moves co-transfections once per (DNA destination, plate well) and single transfections once per row
+def group_plate_transfer(transfers, row, settings):
+    last = transfers[-1] if transfers else None
+    if last is not None and last.rows[0].transfection_type == 'Co' and (row.DNA_dest, row.plate_dest) == (last.rows[0].DNA_dest, last.plate_dest):
+        last.rows.append(row)
+    else:
+        last = PlateTransfer([row], row.L3K_dest, row.plate_dest)
+        transfers.append(last)
+    last.transfection_vol += (row.uL_DNA + row.uL_OM*2 + row.uL_P3K*2) / settings.Excess
+
+
+# sets of DNA sources worth pooling: for each pair of co-transfections, the sources they share at one ratio, with the other
+# co-transfections that have them at that ratio too
+def premix_candidates(groups, premix_names):
+    amounts = [{entry.DNA_source: entry.uL_DNA for entry in group.entries if entry.DNA_source not in premix_names} for group in groups]
+    candidates = {}
+    for a in range(len(groups)):
+        for b in range(a+1, len(groups)):
+            clusters = [] # shared sources, split up by the amount ratio between the two groups
+            for source in sorted(set(amounts[a]) & set(amounts[b])):
+                ratio = amounts[b][source] / amounts[a][source] if amounts[a][source] else 0
+                for cluster in clusters:
+                    if math.isclose(cluster[0], ratio, rel_tol=1e-6):
+                        cluster[1].append(source)
+                        break
+                else:
+                    clusters.append((ratio, [source]))
+            for _, sources in clusters:
+                if len(sources) < 2 or tuple(sources) in candidates:
+                    continue
+                total = sum(amounts[a][source] for source in sources)
+                candidates[tuple(sources)] = [group for group, have in zip(groups, amounts) if all(source in have for source in sources) and
+                    all(math.isclose(have[source] / sum(have[other] for other in sources), amounts[a][source] / total, rel_tol=1e-6) for source in sources)]
+    return candidates
+
+
+# pool shared helper plasmids into premix tubes, as long as that saves transfers: a premix of k sources used by n
+# co-transfections costs k transfers to make and saves n*(k-1)
+def factor_premixes(plan):
+    groups = [group for group in plan.groups if len(group.entries) > 1]
+    while True:
+        candidates = premix_candidates(groups, [premix.name for premix in plan.premixes])
+        saved = {sources: len(members) * (len(sources) - 1) - len(sources) for sources, members in candidates.items()}
+        if not saved or max(saved.values()) <= 0:
+            return
+        sources = max(saved, key=lambda sources: (saved[sources], len(sources)))
+        premix = Premix('DNA mix ' + str(len(plan.premixes) + 1), [], candidates[sources])
+        for source in sources:
+            premix.parts.append((source, sum(entry.uL_DNA for group in premix.groups for entry in group.entries if entry.DNA_source == source) * plan.settings.MM_excess))
+
+        # the pooled entries of each group become one entry that takes from the premix, where the first of them was
+        for group in premix.groups:
+            pooled = [entry for entry in group.entries if entry.DNA_source in sources]
+            first = pooled[0]
+            entry = Entry(first.line, premix.name, first.DNA_dest, first.L3K_dest, 'Co', premix.name)
+            for member in pooled:
+                entry.uL_DNA += member.uL_DNA
+                entry.uL_OM += member.uL_OM
+                entry.uL_P3K += member.uL_P3K
+                entry.uL_L3K += member.uL_L3K
+            for members in (group.entries, plan.entries):
+                members[members.index(first)] = entry
+                for member in pooled[1:]:
+                    members.remove(member)
+        plan.premixes.append(premix)
+
+
+# dilute each DNA source that some transfers would take less than pipette_min uL of, by the smallest factor that gets them to
+# dilution_min_draw; those transfers (and the Step 2/3 volumes they end up in) draw the diluted volume from the dilution instead
+def plan_dilutions(plan):
+    settings = plan.settings
+    unreadable = set(row.line for row in plan.rows if not row.readable)
+    by_source = {}
+    for entry in plan.entries:
+        if entry.uL_DNA < pipette_min and entry.line not in unreadable:
+            by_source.setdefault(entry.DNA_source, []).append(entry)
+
+    factors = {} # (DNA source, DNA destination) -> dilution factor
+    for source, entries in by_source.items():
+        smallest = min(entry.uL_DNA for entry in entries)
+        factor = next((factor for factor in dilution_factors if smallest * factor >= settings.dilution_min_draw), dilution_factors[-1])
+        if smallest * factor < pipette_min:
+            continue # too concentrated even for the largest dilution; validate_plan reports it
+        stock = max(sum(entry.uL_DNA for entry in entries) * settings.MM_excess, float(pipette_min))
+        dilution = Dilution('Dilution ' + str(len(plan.dilutions) + 1), source, factor, stock, stock * (factor - 1), entries)
+        for entry in entries:
+            factors[(source, entry.DNA_dest)] = factor
+            entry.DNA_source = dilution.name
+            entry.uL_DNA *= factor
+        plan.dilutions.append(dilution)
+
+    for plate_transfer in plan.plate_transfers:
+        for row in plate_transfer.rows:
+            factor = factors.get((row.DNA_source, row.DNA_dest))
+            if factor:
+                plate_transfer.transfection_vol += row.uL_DNA * (factor - 1) / settings.Excess
+                row.uL_DNA *= factor
+
+
+# uL of diluent the dilutions take from a reagent ('water' or 'Opti-MEM')
+def diluent_volume(plan, reagent):
+    return sum(dilution.diluent for dilution in plan.dilutions) if plan.settings.diluent == reagent else 0
+
+
+# fingerprint of each transfection (Step 2 group): its rows as planned, line numbers aside, so an edited plate map can be
+# compared with the one before it
+def group_keys(plan):
+    rows = {}
+    for row in plan.rows:
+        rows.setdefault(row.DNA_dest, []).append((row.DNA_source, row.DNA_dest, row.L3K_dest, row.plate_dest, row.transfection_type, row.name,
+            round(row.uL_DNA, 6), round(row.uL_OM, 6), round(row.uL_P3K, 6), round(row.uL_L3K, 6)))
+    return [hashlib.sha256(repr(rows.get(group.DNA_dest)).encode()).hexdigest()[:16] for group in plan.groups]
+
+
+# csv_raw is the csv text, or a pathlib.Path or open file to read it from as it goes (see csv_lines); each row goes straight
+# into the entries, groups and plate transfers, so the csv text is never held whole, but the plan keeps every row (plan.rows
+# and the plate transfers), as validation, dilution and plan_with_changes() look back over them
+def build_plan(csv_raw, settings=None):
+    settings = settings or Settings()
+    plan = Plan(settings, [], [], [], [], [])
+    by_tubes = {} # (DNA source, DNA destination) -> entry, for replicates
+    for row in read_rows(csv_raw, settings, plan.errors):
+        plan.rows.append(row)
+        entry = consolidate(row, by_tubes, settings)
+        if entry is not None:
+            plan.entries.append(entry)
+            group_entry(plan.groups, entry)
+        group_plate_transfer(plan.plate_transfers, row, settings)
+    if settings.predilute_DNA:
+        plan_dilutions(plan)
+    for group in plan.groups:
+        group_volumes(group)
+
+    # figure out total reagent volumes needed
+    plan.OM_MM_vol = sum(entry.uL_OM for entry in plan.entries) * settings.MM_excess
+    plan.P3K_MM_vol = sum(entry.uL_P3K for entry in plan.entries) * settings.MM_excess
+    plan.L3K_MM_vol = sum(entry.uL_L3K for entry in plan.entries) * settings.MM_excess
+    plan.OM_refill = 2*plan.OM_MM_vol + diluent_volume(plan, 'Opti-MEM') > tube_capacity and settings.OM_source == 'tube'
+    if settings.premix_cotransfections:
+        factor_premixes(plan)
+    return plan
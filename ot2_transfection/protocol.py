@@ -0,0 +1,118 @@
+# entry points used by the per-experiment scripts
+from .commands import Pause, compile_commands, tip_demand
+from .deck import Deck, bulk_models, allocate_reagent_tubes, mount_p1000, place_bulk_source, reagent_wells, reagent_load_volumes, plan_tip_racks, tip_replacement_message, print_loading_map
+from .execute import execute
+from .layout import optimize_layout, print_deck_layout
+from .optimize import optimize_commands, print_optimizer_report
+from .plan import build_plan, group_keys
+from .validate import validate_plan
+
+
+# plan a plate map, lay out the deck and compile the command stream; problems are collected in plan.errors and plan.warnings
+def plan_run(csv_raw, settings=None):
+    plan = build_plan(csv_raw, settings)
+    settings = plan.settings
+    setting_errors = []
+    if settings.p1000_mount not in (None, 'left', 'right'):
+        setting_errors.append('p1000_mount must be None, \'left\' or \'right\', not ' + repr(settings.p1000_mount))
+    if settings.OM_source != 'tube' and settings.OM_source not in bulk_models:
+        setting_errors.append('OM_source must be \'tube\', ' + ', '.join(repr(source) for source in bulk_models) + ', not ' + repr(settings.OM_source))
+    if settings.diluent not in ('water', 'Opti-MEM'):
+        setting_errors.append('diluent must be \'water\' or \'Opti-MEM\', not ' + repr(settings.diluent))
+    deck = Deck()
+    if setting_errors:
+        plan.errors += setting_errors
+        plan.deck, plan.commands = deck, []
+        return plan
+    if settings.p1000_mount in ('left', 'right'):
+        mount_p1000(deck, settings.p1000_mount)
+    plan.deck = allocate_reagent_tubes(plan, deck)
+    if settings.OM_source in bulk_models:
+        place_bulk_source(plan.deck, settings.OM_source)
+        if not plan.deck.bulk_source:
+            plan.errors.append('no free deck slot left for the Opti-MEM ' + settings.OM_source)
+    missing = [name for name in reagent_load_volumes(plan) if name not in reagent_wells(plan.deck)]
+    if missing:
+        plan.errors.append('no tube position given for: ' + ', '.join(missing))
+        plan.commands = []
+        return plan
+
+    plan.commands = compile_commands(plan, plan.deck)
+    pauses = [command for command in plan.commands if isinstance(command, Pause)]
+    plan.tip_demand = tip_demand(plan.commands)
+    replacements, tip_errors = plan_tip_racks(plan.deck, plan.tip_demand, [pause.name for pause in pauses])
+    for index, pipettes in replacements.items():
+        pauses[index].replace_tips = pipettes
+
+    # rearrange the deck for this plan's transfers, then compile again so the pause messages name the new slots; not for a plate
+    # map with bad rows, whose transfers can name labware that isn't on the deck
+    if plan.settings.optimize_layout and not plan.errors:
+        optimize_layout(plan.deck, plan.commands)
+        plan.commands = compile_commands(plan, plan.deck)
+        pauses = [command for command in plan.commands if isinstance(command, Pause)]
+        for index, pipettes in replacements.items():
+            pauses[index].replace_tips = pipettes
+    for index, pipettes in replacements.items():
+        pauses[index].message += tip_replacement_message(plan.deck, pipettes, also=bool(pauses[index].message))
+    # reagent pauses minimize_pauses doesn't need, unless the tip racks are swapped at them
+    plan.commands = [command for command in plan.commands if not isinstance(command, Pause) or command.needed or command.replace_tips]
+
+    errors, plan.warnings = validate_plan(plan)
+    plan.errors = errors + tip_errors
+    if not plan.errors:
+        plan.commands, plan.optimizer_report = optimize_commands(plan.commands, plan.deck, plan.settings)
+    return plan
+
+
+# a full plan_run() of an edited plate map, with a report of what the edit changed against the plan of the version before it:
+# plan.changed and plan.removed say which transfections it touched (diff.py reports them). Nothing of the previous plan is
+# reused - the master mixes, reagent tubes, tips and command order depend on the whole map, and the plan has to be the one the
+# robot makes from the same csv - though an unchanged layout search is (see layout.cached_layout)
+def plan_with_changes(previous, csv_raw, settings=None):
+    plan = plan_run(csv_raw, settings)
+    before, after = group_keys(previous), group_keys(plan)
+    plan.changed = [group.DNA_dest for group, key in zip(plan.groups, after) if key not in before]
+    plan.removed = [group.DNA_dest for group in previous.groups if group.DNA_dest not in set(group.DNA_dest for group in plan.groups)]
+    return plan
+
+
+# plan_run() and print the result for the operator; raise SystemExit with every problem listed if the plan can't be run
+def prepare(csv_raw, settings=None):
+    plan = plan_run(csv_raw, settings)
+    for warning in plan.warnings:
+        print('Warning:', warning)
+    if plan.errors:
+        for error in plan.errors:
+            print('Error:', error)
+        raise SystemExit('Program halted. ' + str(len(plan.errors)) + ' problem(s) found in the plate map, see above for details.')
+    pauses = [command for command in plan.commands if isinstance(command, Pause)]
+    replacements = {index: pause.replace_tips for index, pause in enumerate(pauses) if pause.replace_tips}
+    print_deck_layout(plan.deck)
+    print_loading_map(plan, plan.deck, plan.tip_demand, replacements, [pause.name for pause in pauses])
+    print_optimizer_report(plan.optimizer_report)
+    return plan
+
+
+plan_cache = {} # (csv, settings) -> plan; one plan per process, shared by every import of the same script
+
+
+# a plan that is only prepare()d the first time it is called, then reused; lets a script define its plan at import time
+# without paying for it (or halting on a bad csv) until run()
+class LazyPlan:
+    def __init__(self, csv_raw, settings=None):
+        self.csv_raw = csv_raw
+        self.settings = settings
+
+    def __call__(self):
+        key = (self.csv_raw, repr(self.settings))
+        if key not in plan_cache:
+            plan_cache[key] = prepare(self.csv_raw, self.settings)
+        return plan_cache[key]
+
+
+def lazy_plan(csv_raw, settings=None):
+    return LazyPlan(csv_raw, settings)
+
+
+def run(protocol, plan):
+    execute(protocol, plan)
@@ -0,0 +1,49 @@
+# plan reports - what a plan-only run reports for one plate map, for the command line and the planning service
+from .commands import Transfer, Distribute, Pause, Delay, Tip, steps, tips_used
+from .layout import load_labware_config
+from .ledger import reagent_volumes
+from .timing import step_seconds
+
+
+def location(labware_well):
+    return labware_well[0] + ' ' + labware_well[1]
+
+
+def command_report(command):
+    report = {'label': command.label, 'pipette': command.pipette, 'volume': round(command.volume, 2), 'source': location(command.source), 'tips': tips_used(command)}
+    if isinstance(command, Transfer):
+        report['dest'] = location(command.dest)
+    else:
+        report['dests'] = [{'dest': location(dest), 'volume': round(volume, 2)} for dest, volume in command.dests]
+    if command.liquid is not None:
+        report['liquid'] = command.liquid.name
+    if command.line:
+        report['line'] = command.line
+    return report
+
+
+# the plan's problems, master mixes, reagents and deck, and unless it has errors its tips, estimated run time and commands
+def plan_summary(plan, report):
+    report['errors'] = plan.errors
+    report['warnings'] = plan.warnings
+    report['master_mix'] = {'OM_MM_vol': round(plan.OM_MM_vol, 2), 'P3K_MM_vol': round(plan.P3K_MM_vol, 2), 'L3K_MM_vol': round(plan.L3K_MM_vol, 2), 'OM_refill': plan.OM_refill}
+    report['reagent_tubes'] = plan.deck.reagent_tubes
+    report['labware'] = load_labware_config(plan.deck)
+    # a bad row can name a location that isn't on the deck, so a plan with errors isn't worth estimating
+    if not plan.commands or plan.errors:
+        return report
+
+    report['reagents_uL'] = {reagent: round(uL, 1) for reagent, uL in reagent_volumes(plan).items()}
+    report['tips'] = {pipette: sum(stretch[pipette] for stretch in plan.tip_demand) for pipette in plan.deck.tip_rack_slots}
+    seconds = step_seconds(plan.commands, plan.deck)
+    report['estimated_seconds'] = dict({step: round(seconds[step]) for step in steps}, total=round(sum(seconds.values())))
+    report['steps'] = {step: [] for step in steps}
+    for command in plan.commands:
+        if isinstance(command, (Transfer, Distribute)):
+            report['steps'][command.step].append(command_report(command))
+        elif isinstance(command, Pause):
+            report.setdefault('pauses', []).append({'step': command.step, 'name': command.name, 'replace_tips': command.replace_tips})
+        elif isinstance(command, Delay):
+            report.setdefault('delays', []).append({'step': command.step, 'name': command.name, 'seconds': command.seconds})
+    report['single_tip_blocks'] = sum(1 for command in plan.commands if isinstance(command, Tip) and command.action == 'pick_up')
+    return report
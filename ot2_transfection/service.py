@@ -0,0 +1,210 @@
+# planning service - a local HTTP server that plans plate maps for everyone with the same library, so nobody plans with an old
+# copy of a script. Plans are worked out in a process pool, so a big plate map never holds up the others, and kept by content
+# hash, so the same plate map and settings are only planned once
+#   python -m ot2_transfection serve --port 8470
+#   curl --data-binary @map.csv 'localhost:8470/plan?Excess=1.3&name=uORF+library'
+# POST /plan takes the csv as the body (settings in the query string), or JSON {"csv": ..., "settings": {...}, "name": ...}, and
+# answers with the plan report (see report.py) plus 'hash' and 'protocol', a protocol script to upload to a robot that has the
+# library installed (see README.md); GET /plans/<hash>/protocol.py gives the script again
+import asyncio
+import hashlib
+import json
+import urllib.parse
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from .plan import Settings
+from .protocol import plan_run
+from .report import plan_summary
+
+max_body = 8 * 1024 * 1024 # bytes; a full deck's csv is a few kB
+statuses = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+protocol_template = '''# planned by the transfection planning service ({hash}); the ot2_transfection library has to be on the robot in
+# /data/user_storage (see README.md)
+
+# imports
+import sys
+from opentrons import protocol_api
+sys.path.insert(0, '/data/user_storage')
+import ot2_transfection as transfection
+
+# metadata
+metadata = {{
+    "protocolName": {name},
+    "description": "Automates all steps in the 3-step transfection protocol: i) mix DNA; ii) prepare P3000/L3000; iii) transfect cells."
+}}
+
+# requirements
+requirements = {{"robotType": "OT-2", "apiLevel": "2.19"}}
+
+csv_raw = {csv}
+
+settings = transfection.Settings({settings})
+
+plan = transfection.lazy_plan(csv_raw, settings)
+
+# protocol run function
+def run(protocol: protocol_api.ProtocolContext):
+    transfection.run(protocol, plan())
+'''
+
+
+class RequestError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+# same plate map and settings, same plan; settings are hashed in a fixed order, and only those that differ from the defaults
+def content_hash(csv_raw, overrides):
+    data = json.dumps({'csv': csv_raw, 'settings': overrides}, sort_keys=True)
+    return hashlib.sha256(data.encode()).hexdigest()[:16]
+
+
+# the csv and name go in as Python string literals, so whatever quotes or backslashes they hold the script stays valid
+def protocol_script(csv_raw, overrides, name, key):
+    return protocol_template.format(hash=key, name=repr(str(name)), csv=repr(csv_raw), settings=', '.join(field + '=' + repr(value) for field, value in sorted(overrides.items())))
+
+
+# runs in a pool worker; csv_raw is always the csv text (see plan.csv_lines), never a path on this machine
+def compile_plate_map(csv_raw, overrides, key):
+    report = {'hash': key, 'errors': [], 'warnings': []}
+    try:
+        plan = plan_run(csv_raw, Settings(**overrides))
+    except Exception as error:
+        report['errors'].append('could not plan: ' + type(error).__name__ + ': ' + str(error))
+        return report
+    return plan_summary(plan, report)
+
+
+# a request's csv, Settings overrides and name; query string values are read as JSON when they can be, as with --set
+def parse_submission(body, query, content_type):
+    if content_type.startswith('application/json'):
+        try:
+            submission = json.loads(body)
+        except ValueError as error:
+            raise RequestError(400, 'body is not valid JSON: ' + str(error))
+        if not isinstance(submission, dict) or not isinstance(submission.get('csv'), str):
+            raise RequestError(400, 'JSON body needs a "csv" string')
+        csv_raw, overrides, name = submission['csv'], submission.get('settings') or {}, submission.get('name')
+        if name is not None and not isinstance(name, str):
+            raise RequestError(400, '"name" has to be a string')
+    else:
+        csv_raw, overrides, name = body.decode('utf-8-sig'), {}, None
+        for field, values in query.items():
+            if field == 'name':
+                name = values[-1]
+                continue
+            try:
+                overrides[field] = json.loads(values[-1])
+            except ValueError:
+                overrides[field] = values[-1]
+    unknown = [field for field in overrides if field not in Settings.__dataclass_fields__]
+    if unknown:
+        raise RequestError(400, 'unknown setting(s) ' + ', '.join(repr(field) for field in unknown) + '; see Settings in ot2_transfection/plan.py')
+    try:
+        Settings(**overrides)
+    except TypeError as error:
+        raise RequestError(400, str(error))
+    defaults = Settings()
+    overrides = {field: value for field, value in overrides.items() if value != getattr(defaults, field)}
+    return csv_raw, overrides, name or 'transfection'
+
+
+class PlanService:
+    def __init__(self, jobs=None, cache_size=256):
+        self.pool = ProcessPoolExecutor(max_workers=jobs)
+        self.cache = OrderedDict() # hash -> (report, csv, overrides, name), least recently used first
+        self.cache_size = cache_size
+        self.pending = {} # hash -> future of a plan being worked out, so the same submission twice is planned once
+
+    # the report, with a protocol script named for this submission if the plan can be run
+    async def plan(self, csv_raw, overrides, name):
+        key = content_hash(csv_raw, overrides)
+        cached = key in self.cache
+        if cached:
+            self.cache.move_to_end(key)
+            report = self.cache[key][0]
+        else:
+            if key not in self.pending:
+                self.pending[key] = asyncio.get_running_loop().run_in_executor(self.pool, compile_plate_map, csv_raw, overrides, key)
+            try:
+                report = await asyncio.shield(self.pending[key])
+            finally:
+                self.pending.pop(key, None)
+        self.cache[key] = (report, csv_raw, overrides, name)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        response = dict(report, name=name, cached=cached)
+        if not report['errors']:
+            response['protocol'] = protocol_script(csv_raw, overrides, name, key)
+        return response
+
+    async def respond(self, method, path, query, body, content_type):
+        if path == '/health':
+            return 200, 'application/json', json.dumps({'cached_plans': len(self.cache), 'planning': len(self.pending)})
+        if path == '/plan':
+            if method != 'POST':
+                raise RequestError(405, 'POST a plate map csv to /plan')
+            report = await self.plan(*parse_submission(body, query, content_type))
+            return 200, 'application/json', json.dumps(report)
+        parts = path.strip('/').split('/')
+        if len(parts) == 3 and parts[0] == 'plans' and parts[2] == 'protocol.py':
+            if parts[1] not in self.cache or self.cache[parts[1]][0]['errors']:
+                raise RequestError(404, 'no plan ' + parts[1] + ' that can be run; submit it to /plan again')
+            _, csv_raw, overrides, name = self.cache[parts[1]]
+            return 200, 'text/x-python', protocol_script(csv_raw, overrides, name, parts[1])
+        raise RequestError(404, 'unknown path ' + path)
+
+    # one HTTP/1.1 request per connection
+    async def handle(self, reader, writer):
+        try:
+            try:
+                request_line = (await reader.readline()).decode('latin-1').split()
+                if len(request_line) != 3:
+                    raise RequestError(400, 'bad request line')
+                method, target, _ = request_line
+                headers = {}
+                while True:
+                    line = (await reader.readline()).decode('latin-1')
+                    if line in ('\r\n', '\n', ''):
+                        break
+                    header, _, value = line.partition(':')
+                    headers[header.strip().lower()] = value.strip()
+                length = int(headers.get('content-length', 0))
+                if length > max_body:
+                    raise RequestError(413, 'plate maps over ' + str(max_body) + ' bytes are not accepted')
+                body = await reader.readexactly(length)
+                url = urllib.parse.urlsplit(target)
+                status, content_type, text = await self.respond(method, url.path, urllib.parse.parse_qs(url.query), body, headers.get('content-type', ''))
+            except RequestError as error:
+                status, content_type, text = error.status, 'application/json', json.dumps({'errors': [str(error)]})
+            except (ValueError, asyncio.IncompleteReadError) as error:
+                status, content_type, text = 400, 'application/json', json.dumps({'errors': ['bad request: ' + str(error)]})
+            except Exception as error:
+                status, content_type, text = 500, 'application/json', json.dumps({'errors': [type(error).__name__ + ': ' + str(error)]})
+            data = text.encode()
+            writer.write(('HTTP/1.1 ' + str(status) + ' ' + statuses[status] + '\r\nContent-Type: ' + content_type + '; charset=utf-8\r\nContent-Length: ' +
+                str(len(data)) + '\r\nConnection: close\r\n\r\n').encode('latin-1') + data)
+            await writer.drain()
+        except ConnectionError:
+            pass # the client went away
+        finally:
+            writer.close()
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle, host, port)
+        print('planning plate maps on http://' + host + ':' + str(port) + '/plan')
+        async with server:
+            await server.serve_forever()
+
+
+def serve(host='127.0.0.1', port=8470, jobs=None, cache_size=256):
+    service = PlanService(jobs, cache_size)
+    try:
+        asyncio.run(service.serve(host, port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.pool.shutdown(cancel_futures=True)
@@ -0,0 +1,129 @@
+# parameter sweep - plan every combination of a grid of settings and DNA doses, and rank the plans that fit on one deck
+#   python -m ot2_transfection sweep base_map.csv grid.json --top 5 --out best/
+# grid.json holds lists of values for any Settings field, the dose series to lay out and optional prices, e.g.
+#   {"P3K": [0.0015, 0.0022], "L3K": [0.0015, 0.0022, 0.003], "DNA wanted (ng)": [[250, 500, 750]], "replicates": [1, 2],
+#    "prices": {"L3000": 1.0, "P3000": 0.4}}
+import csv
+import io
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+from .deck import Deck, reagent_load_volumes
+from .plan import Settings, csv_columns, csv_lines, header_key, tube_wells
+from .protocol import plan_run
+from .timing import command_seconds
+
+# relative cost per uL of each reagent the operator loads; set real prices in the grid to rank by money
+default_prices = {'L3000': 1.0, 'P3000': 1.0, 'Opti-MEM': 0.0, 'Opti-MEM 2': 0.0}
+
+
+# the transfections of a plate map: each single row on its own, co-transfection rows together by DNA destination. The csv is
+# read as build_plan() reads it (plan.csv_lines, headers matched with plan.header_key), and each row keeps just the csv_columns
+def read_transfections(csv_raw):
+    csv_reader = csv.reader(csv_lines(csv_raw))
+    columns = {header_key(name): number for number, name in enumerate(next(csv_reader, []))}
+    missing = [name for name in csv_columns if header_key(name) not in columns]
+    if missing:
+        raise ValueError('the base csv header is missing ' + ', '.join('"' + name + '"' for name in missing))
+    positions = [columns[header_key(name)] for name in csv_columns]
+    transfections = []
+    by_dest = {}
+    for fields in csv_reader:
+        if len(fields) <= max(positions):
+            continue # blank, or too short to plan; build_plan() reports it when the map is planned
+        row = {name: fields[position] for name, position in zip(csv_columns, positions)}
+        if row['Transfection type'] == 'Co' and row['DNA destination'] in by_dest:
+            by_dest[row['DNA destination']].append(row)
+        else:
+            transfections.append([row])
+            by_dest[row['DNA destination']] = transfections[-1]
+    return transfections
+
+
+# a plate map with every transfection at every dose (a co-transfection keeps its ratios, scaled to the dose in total; a dose
+# of None keeps the base map's amounts), each dose
+# series in neighbouring wells across plate1 then plate2; None if it needs more tubes or plate wells than the deck has
+def dose_layout(transfections, doses, replicates):
+    deck = Deck()
+    sources = set(row['DNA source'] for rows in transfections for row in rows)
+    free_tubes = [well + '.' + rack for rack in sorted(deck.tuberack_slots) for well in tube_wells if well + '.' + rack not in sources]
+    plate_wells = [well + '.' + plate for plate in sorted(deck.plate_slots) for well in tube_wells]
+    needed = len(transfections) * len(doses) * replicates
+    if needed > len(plate_wells) or 2 * needed > len(free_tubes):
+        return None
+
+    out = io.StringIO()
+    writer = csv.DictWriter(out, csv_columns, lineterminator='\n')
+    writer.writeheader()
+    count = 0
+    for rows in transfections:
+        total = sum(float(row['DNA wanted (ng)']) for row in rows)
+        for dose in doses:
+            for _ in range(replicates):
+                DNA_dest, L3K_dest, plate_dest = free_tubes[2*count], free_tubes[2*count + 1], plate_wells[count]
+                for row in rows:
+                    writer.writerow(dict(row, **{'DNA destination': DNA_dest, 'L3K/OM MM destination': L3K_dest, 'Plate destination': plate_dest,
+                        'DNA wanted (ng)': round(float(row['DNA wanted (ng)']) * (dose / total if dose is not None else 1), 2)}))
+                count += 1
+    return out.getvalue()
+
+
+# one candidate per combination of the grid's settings, dose series and replicate counts
+def sweep_candidates(base_csv, grid):
+    transfections = read_transfections(base_csv)
+    doses = grid.get('DNA wanted (ng)', [[None]])
+    if doses and not isinstance(doses[0], list):
+        doses = [doses] # a single dose series
+    fields = sorted(name for name in grid if name in Settings.__dataclass_fields__)
+    candidates = []
+    for values in itertools.product(*(grid[name] for name in fields)):
+        for series in doses:
+            for replicates in grid.get('replicates', [1]):
+                parameters = dict(zip(fields, values), doses=series, replicates=replicates)
+                candidates.append((parameters, dose_layout(transfections, series, replicates), grid.get('prices', {})))
+    return candidates
+
+
+# plan one candidate and score it; top-level so the process pool can send it to a worker
+def plan_candidate(candidate):
+    parameters, csv_raw, prices = candidate
+    result = {'parameters': parameters, 'fits': False}
+    if csv_raw is None:
+        result['errors'] = ['needs more tubes or plate wells than one deck has']
+        return result
+    settings = Settings(**{name: value for name, value in parameters.items() if name in Settings.__dataclass_fields__})
+    plan = plan_run(csv_raw, settings)
+    result['errors'] = plan.errors
+    if plan.errors or not plan.commands:
+        return result
+    prices = dict(default_prices, **prices)
+    volumes = reagent_load_volumes(plan)
+    cost = sum(volume * prices.get(name, 0) for name, volume in volumes.items())
+    result.update({
+        'fits': True,
+        'csv': csv_raw,
+        'wells': len(plan.plate_transfers),
+        'reagent_cost': round(cost, 2),
+        'cost_per_well': round(cost / len(plan.plate_transfers), 3),
+        'reagent_volumes': {name: round(volume, 1) for name, volume in volumes.items() if volume},
+        'tips': sum(sum(stretch.values()) for stretch in plan.tip_demand),
+        'estimated_seconds': round(sum(command_seconds(plan.commands, plan.deck))),
+        })
+    return result
+
+
+# plan every candidate in parallel; plans that fit come first, lowest reagent cost per plate well first (layouts of different
+# sizes compare fairly), then fewest tips, then shortest run
+def run_sweep(base_csv, grid, jobs=None):
+    candidates = sweep_candidates(base_csv, grid)
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        results = list(pool.map(plan_candidate, candidates, chunksize=4))
+    return sorted(results, key=lambda result: (not result['fits'], result.get('cost_per_well', 0), result.get('tips', 0), result.get('estimated_seconds', 0)))
+
+
+def print_ranking(results, top):
+    fitting = [result for result in results if result['fits']]
+    print(str(len(fitting)) + ' of ' + str(len(results)) + ' candidates fit on one deck' + (', best ' + str(min(top, len(fitting))) + ':' if fitting else '.'))
+    for rank, result in enumerate(fitting[:top], 1):
+        parameters = ', '.join(name + '=' + str(value) for name, value in result['parameters'].items())
+        print('  ' + str(rank).rjust(2) + '. cost ' + str(result['reagent_cost']) + ' (' + str(result['cost_per_well']) + ' per well), ' + str(result['tips']) + ' tips, ' + str(round(result['estimated_seconds'] / 60, 1)) + ' min - ' + parameters)
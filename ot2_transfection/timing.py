@@ -0,0 +1,155 @@
+# run time estimate - approximate seconds for each command, from the deck layout, volumes and flow rates
+import json
+import os
+
+from .commands import Transfer, Distribute, Delay, Tip, Setting, transfer_volumes, distribute_fills, steps
+from .deck import pipette_specs, tube_xy, slot_xy
+
+# rough OT-2 figures; good enough to compare two versions of a command stream, not to promise a finish time
+default_timing = {
+    'gantry_speed': 400, # mm/sec across the deck
+    'move': 1.2, # sec to rise out of one labware and lower into the next, on top of the travel
+    'pick_up_tip': 2.5,
+    'drop_tip': 1.5,
+    'blow_out': 1.5, # including the move up to the top of the well
+    'touch_tip': 3,
+    'plunger': 0.3, # sec to start and stop the plunger for each aspirate or dispense
+    'flow_scale': 1, # actual / nominal time to move a volume at a flow rate
+    'mix_cycle': 0, # sec per mix cycle on top of its aspirate and dispense
+    }
+
+trash_slot = '12'
+
+# figures fitted to this lab's robots by calibrate.py; used instead of the defaults above wherever it exists
+timing_model_file = os.path.expanduser('~/.ot2_transfection/timing_model.json')
+measured = {} # path -> (modified time, timing)
+
+
+def measured_timing(path=None):
+    path = path or timing_model_file
+    if not os.path.exists(path):
+        return {}
+    modified = os.path.getmtime(path)
+    if path not in measured or measured[path][0] != modified:
+        with open(path) as f:
+            measured[path] = (modified, json.load(f)['timing'])
+    return measured[path][1]
+
+
+# approximate position in mm of a tube or plate well on the deck; the bulk Opti-MEM source counts as the middle of its slot
+def well_xy(deck, labware, well):
+    if labware == 'bulk':
+        return slot_xy(deck.bulk_slot)
+    if labware.startswith('tuberack'):
+        return tube_xy(deck, well + '.' + labware[len('tuberack'):])
+    slot = int(deck.plate_slots[labware[len('plate'):]]) - 1
+    x = (slot % 3) * 132.5 + 17.48 + (int(well[1:]) - 1) * 19.3
+    y = (slot // 3) * 90.5 + 71.67 - 'ABCD'.index(well[0]) * 19.3
+    return x, y
+
+
+class Estimator:
+    def __init__(self, deck, timing=None):
+        self.deck = deck
+        self.timing = dict(default_timing, **measured_timing(), **(timing or {}))
+        self.flow_rates = {name: {'aspirate': spec['default_flow_rate'], 'dispense': spec['default_flow_rate']} for name, spec in pipette_specs.items()}
+        self.position = slot_xy(trash_slot)
+        self.parts = None # set to a list to get the (operation, seconds) of each command back, for trace.py
+
+    # seconds for one operation of a command
+    def part(self, name, seconds):
+        if self.parts is not None:
+            self.parts.append((name, seconds))
+        return seconds
+
+    def move(self, xy):
+        distance = ((xy[0] - self.position[0])**2 + (xy[1] - self.position[1])**2) ** 0.5
+        self.position = xy
+        return self.timing['move'] + distance / self.timing['gantry_speed']
+
+    def tip(self, pipette, action):
+        if action == 'pick_up':
+            return self.move(slot_xy(self.deck.tip_rack_slots[pipette][0])) + self.timing['pick_up_tip']
+        return self.move(slot_xy(trash_slot)) + self.timing['drop_tip']
+
+    def plunger(self, volume, rate):
+        return self.timing['plunger'] + self.timing['flow_scale'] * volume / rate
+
+    def mix(self, mix, rates):
+        return mix[0] * (self.timing['mix_cycle'] + self.plunger(mix[1], rates['aspirate']) + self.plunger(mix[1], rates['dispense']))
+
+    def rates(self, command):
+        rates = dict(self.flow_rates[command.pipette])
+        if command.liquid is not None:
+            rates['aspirate'] = command.liquid.aspirate_flow_rate.get(command.pipette, rates['aspirate'])
+            rates['dispense'] = command.liquid.dispense_flow_rate.get(command.pipette, rates['dispense'])
+        return rates
+
+    def transfer(self, command):
+        liquid = command.liquid
+        rates = self.rates(command)
+        blow_out = command.blow_out and (liquid is None or liquid.blow_out)
+        touch_tip = liquid is not None and liquid.touch_tip
+
+        def mix(mix):
+            return self.part('mix', self.mix(mix, rates)) if mix[0] else 0
+
+        seconds = 0
+        for volume in transfer_volumes(command.volume, pipette_specs[command.pipette]['max_volume']):
+            if command.new_tip == 'always':
+                seconds += self.part('pick up tip', self.tip(command.pipette, 'pick_up'))
+            seconds += self.part('move', self.move(well_xy(self.deck, *command.source))) + mix(command.mix_before)
+            seconds += self.part('aspirate', self.plunger(volume, rates['aspirate']) + (liquid.aspirate_delay if liquid else 0))
+            seconds += self.part('touch tip', self.timing['touch_tip']) if touch_tip else 0
+            seconds += self.part('move', self.move(well_xy(self.deck, *command.dest)))
+            seconds += self.part('dispense', self.plunger(volume, rates['dispense']) + (liquid.dispense_delay if liquid else 0))
+            seconds += mix(command.mix_after)
+            seconds += self.part('blow out', self.timing['blow_out']) if blow_out else 0
+            seconds += self.part('touch tip', self.timing['touch_tip']) if touch_tip else 0
+            if command.new_tip == 'always':
+                seconds += self.part('drop tip', self.tip(command.pipette, 'drop'))
+        return seconds
+
+    def distribute(self, command):
+        liquid = command.liquid
+        rates = self.rates(command)
+        seconds = self.part('pick up tip', self.tip(command.pipette, 'pick_up')) + self.part('move', self.move(well_xy(self.deck, *command.source)))
+        if command.mix_before[0]:
+            seconds += self.part('mix', self.mix(command.mix_before, rates))
+        for fill in distribute_fills(command):
+            seconds += self.part('move', self.move(well_xy(self.deck, *command.source)))
+            seconds += self.part('aspirate', self.plunger(sum(volume for _, volume in fill) + command.disposal, rates['aspirate']) + (liquid.aspirate_delay if liquid else 0))
+            seconds += self.part('touch tip', self.timing['touch_tip']) if liquid is not None and liquid.touch_tip else 0
+            for dest, volume in fill:
+                seconds += self.part('move', self.move(well_xy(self.deck, *dest)))
+                seconds += self.part('dispense', self.plunger(volume, rates['dispense']) + (liquid.dispense_delay if liquid else 0))
+            seconds += self.part('move', self.move(well_xy(self.deck, *command.source))) + self.part('blow out', self.timing['blow_out'])
+        return seconds + self.part('drop tip', self.tip(command.pipette, 'drop'))
+
+    # seconds for one command; pauses count as 0 since they wait on the operator, delays as their full length
+    def command(self, command):
+        if isinstance(command, Delay):
+            return command.seconds
+        if isinstance(command, Transfer):
+            return self.transfer(command)
+        if isinstance(command, Distribute):
+            return self.distribute(command)
+        if isinstance(command, Tip):
+            return self.part('pick up tip' if command.action == 'pick_up' else 'drop tip', self.tip(command.pipette, command.action))
+        if isinstance(command, Setting) and command.attribute.startswith('flow_rate.'):
+            self.flow_rates[command.pipette][command.attribute.split('.')[1]] = command.value
+        return 0
+
+
+# estimated seconds of robot time for each command
+def command_seconds(commands, deck, timing=None):
+    estimator = Estimator(deck, timing)
+    return [estimator.command(command) for command in commands]
+
+
+# estimated seconds per step, in run order
+def step_seconds(commands, deck, timing=None):
+    totals = {step: 0 for step in steps}
+    for command, seconds in zip(commands, command_seconds(commands, deck, timing)):
+        totals[command.step] += seconds
+    return totals
@@ -0,0 +1,140 @@
+# run timeline - Chrome trace event JSON (open in ui.perfetto.dev or chrome://tracing) with a span for each step, command,
+# pipetting operation and operator pause; estimated from the plan for simulated runs, timed on the robot for real ones
+import json
+import time
+
+from .calibrate import CommandFeatures
+from .commands import Transfer, Distribute, Pause, Delay, Tip, Setting
+from .timing import Estimator
+
+robot, operator = 1, 2 # trace tracks: what the robot does, and the pauses where it waits on the operator
+
+
+def command_name(command):
+    if isinstance(command, (Transfer, Distribute)):
+        return command.label
+    if isinstance(command, (Pause, Delay)):
+        return command.name
+    if isinstance(command, Tip):
+        return command.pipette + (' pick up tip' if command.action == 'pick_up' else ' drop tip')
+    return command.pipette + ' ' + command.attribute + ' = ' + str(command.value)
+
+
+def command_args(index, command):
+    args = {'command': index}
+    if isinstance(command, (Transfer, Distribute)):
+        args.update({'pipette': command.pipette, 'volume': round(command.volume, 2), 'source': command.source[0] + ' ' + command.source[1]})
+        if command.line:
+            args['line'] = command.line
+    elif isinstance(command, (Pause, Delay)):
+        args['message'] = command.message
+    return args
+
+
+class Trace:
+    def __init__(self):
+        self.events = [
+            {'ph': 'M', 'name': 'process_name', 'pid': 1, 'tid': robot, 'args': {'name': 'OT-2 transfection'}},
+            {'ph': 'M', 'name': 'thread_name', 'pid': 1, 'tid': robot, 'args': {'name': 'robot'}},
+            {'ph': 'M', 'name': 'thread_name', 'pid': 1, 'tid': operator, 'args': {'name': 'operator'}},
+            ]
+        self.commands = [] # (index, command, start, end) in run order
+
+    # a span from start to end seconds into the run
+    def span(self, name, category, start, end, track=robot, args=None):
+        event = {'ph': 'X', 'name': name, 'cat': category, 'pid': 1, 'tid': track, 'ts': round(start * 1e6), 'dur': round((end - start) * 1e6)}
+        if args:
+            event['args'] = args
+        self.events.append(event)
+
+    def command(self, index, command, start, end):
+        self.commands.append((index, command, start, end))
+        if isinstance(command, Pause):
+            self.span(command_name(command), 'pause', start, end, operator, command_args(index, command))
+        elif isinstance(command, Delay):
+            self.span(command_name(command), 'delay', start, end, robot, command_args(index, command))
+        elif not isinstance(command, Setting):
+            self.span(command_name(command), 'command', start, end, robot, command_args(index, command))
+
+    # one span per stretch of robot work from the same step; a pause or delay ends the stretch, so the wait shows as a gap
+    def step_spans(self):
+        stretch = None
+        work = [entry for entry in self.commands if not isinstance(entry[1], Setting)] # settings take no time
+        for _, command, start, end in work + [(None, None, None, None)]:
+            waiting = isinstance(command, (Pause, Delay))
+            if stretch is not None and command is not None and not waiting and stretch[0] == command.step:
+                stretch[2] = end
+                continue
+            if stretch is not None:
+                self.span(stretch[0], 'step', stretch[1], stretch[2])
+            stretch = [command.step, start, end] if command is not None and not waiting else None
+
+    def write(self, path):
+        self.step_spans()
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, f)
+
+
+# the timeline the run time estimate expects (see timing.py); pauses take pause_seconds, a guess at how long the operator takes
+def estimated_trace(plan, pause_seconds=0):
+    trace = Trace()
+    estimator = Estimator(plan.deck)
+    clock = 0
+    for index, command in enumerate(plan.commands):
+        estimator.parts = []
+        seconds = pause_seconds if isinstance(command, Pause) else estimator.command(command)
+        start = clock
+        for name, part_seconds in estimator.parts:
+            if part_seconds > 0:
+                trace.span(name, 'operation', clock, clock + part_seconds)
+            clock += part_seconds
+        clock = start + seconds
+        trace.command(index, command, start, clock)
+    return trace
+
+
+# a trace timed with the wall clock as the robot runs; wrap the pipettes in TracedPipette for spans of their operations.
+# Each timed command also carries the terms calibrate.py fits the run time estimate with
+class RunTrace(Trace):
+    def __init__(self, deck):
+        super().__init__()
+        self.features = CommandFeatures(deck)
+        self.start = time.monotonic()
+
+    def now(self):
+        return time.monotonic() - self.start
+
+    def command(self, index, command, start, end):
+        base, features = self.features.command(command)
+        super().command(index, command, start, end)
+        if isinstance(command, (Transfer, Distribute, Tip)):
+            self.events[-1]['args'].update({'base_seconds': round(base, 6), 'features': features})
+
+    # a setting from the finished part of a resumed run: no span, but the flow rates it set carry over into the features
+    def skipped(self, command):
+        self.features.command(command)
+
+
+class TracedPipette:
+    operations = {'pick_up_tip': 'pick up tip', 'drop_tip': 'drop tip', 'aspirate': 'aspirate', 'dispense': 'dispense', 'mix': 'mix',
+        'blow_out': 'blow out', 'touch_tip': 'touch tip', 'transfer': 'transfer'}
+
+    def __init__(self, pipette, trace):
+        object.__setattr__(self, 'pipette', pipette)
+        object.__setattr__(self, 'trace', trace)
+
+    def __getattr__(self, attribute):
+        value = getattr(self.pipette, attribute)
+        if attribute not in self.operations:
+            return value
+
+        def traced(*args, **kwargs):
+            start = self.trace.now()
+            try:
+                return value(*args, **kwargs)
+            finally:
+                self.trace.span(self.operations[attribute], 'operation', start, self.trace.now())
+        return traced
+
+    def __setattr__(self, attribute, value):
+        setattr(self.pipette, attribute, value)
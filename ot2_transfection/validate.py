@@ -0,0 +1,112 @@
+# pre-run checks - every problem with a plan is collected and reported together, so a bad plate map fails before the run instead of halfway through it
+import math
+
+from .commands import Transfer, Distribute, moves, distribute_fills
+from .deck import tube, pipette_specs, bulk_models
+from .plan import tube_capacity, pipette_min
+
+
+# checks on the csv as a whole: plate wells, tube roles, co-transfection order and fixed reagent tubes (locations and
+# transfection types are checked as the rows are read, see plan.check_row)
+def check_rows(plan, deck, errors):
+    fixed = {location: name for name, location in deck.reagent_tubes.items()} if plan.settings.reagent_positions else {}
+    plate_owners = {} # plate well -> the Step 3 transfer that fills it
+    for plate_transfer in plan.plate_transfers:
+        for row in plate_transfer.rows:
+            if plate_owners.setdefault(row.plate_dest, id(plate_transfer)) != id(plate_transfer):
+                errors.append('line ' + str(row.line) + ': plate well ' + row.plate_dest + ' is already filled by another transfection')
+
+    for row in plan.rows:
+        for location, column in ((row.DNA_source, 'DNA source'), (row.DNA_dest, 'DNA destination'), (row.L3K_dest, 'L3K/OM MM destination')):
+            if location in fixed:
+                errors.append('line ' + str(row.line) + ': "' + column + '" ' + location + ' collides with the ' + fixed[location] + ' tube')
+
+    roles = {} # what each tube location is used for; a location may only have one role
+    def claim(location, role, line):
+        if roles.setdefault(location, role) != role:
+            errors.append('line ' + str(line) + ': tube ' + location + ' is used as ' + role + ' but is also used as ' + roles[location])
+
+    unreadable = set(row.line for row in plan.rows if not row.readable)
+    dest_owners = {} # DNA/L3K destination tube -> the group that fills it
+    seen = set()
+    for group in plan.groups:
+        key = (group.DNA_dest, group.L3K_dest)
+        line = group.entries[0].line
+        # co-transfection groups are gathered assuming their rows are next to each other
+        if group.entries[0].transfection_type == 'Co' and key in seen:
+            errors.append('line ' + str(line) + ': co-transfection rows for ' + group.DNA_dest + '/' + group.L3K_dest + ' must be next to each other in the csv')
+        seen.add(key)
+        for location in key:
+            if dest_owners.setdefault(location, id(group)) != id(group):
+                errors.append('line ' + str(line) + ': destination tube ' + location + ' is shared with another transfection; mark the rows as Co if they should be mixed')
+        for entry in group.entries:
+            claim(entry.DNA_source, 'a DNA source', entry.line)
+            claim(entry.DNA_dest, 'a DNA destination', entry.line)
+            claim(entry.L3K_dest, 'an L3K/OM MM destination', entry.line)
+            if entry.uL_DNA < pipette_min and entry.line not in unreadable:
+                errors.append('line ' + str(entry.line) + ': DNA concentration in tube ' + entry.name + ' (' + entry.DNA_source + ') is too high (' + str(round(entry.uL_DNA, 2)) + ' uL required, minimum is ' + str(pipette_min) + ' uL). Please dilute DNA so at least ' + str(pipette_min) + ' uL can be used.')
+
+
+# checks on the command stream: volumes the pipettes can't do in one go and tubes that overflow
+def check_commands(plan, commands, errors, warnings):
+    names = {tube(location): name + ' tube' for name, location in plan.deck.reagent_tubes.items()}
+    unreadable = set(row.line for row in plan.rows if not row.readable)
+    tube_in, tube_out = {}, {}
+    below_minimum = {} # pipette -> transfers under its rated minimum, left to it because no smaller pipette is mounted
+    for command in commands:
+        for source, dest, volume in moves(command):
+            if source[0].startswith('tuberack'):
+                tube_out[source] = tube_out.get(source, 0) + volume
+            if dest[0].startswith('tuberack'):
+                tube_in[dest] = tube_in.get(dest, 0) + volume
+        # each fill of a multi-dispense goes up in one aspiration, with the disposal volume on top
+        if isinstance(command, Distribute):
+            max_volume = pipette_specs[command.pipette]['max_volume']
+            for fill in distribute_fills(command):
+                uL = sum(volume for _, volume in fill) + command.disposal
+                if uL > max_volume:
+                    errors.append(command.step + ', ' + command.label + (' (line ' + str(command.line) + ')' if command.line else '') + ': a fill of ' + str(round(uL, 2)) +
+                        ' uL with the disposal volume is over the ' + str(max_volume) + ' uL ' + command.pipette + ' capacity')
+        if not isinstance(command, Transfer):
+            continue
+        where = command.step + ', ' + command.label + (' (line ' + str(command.line) + ')' if command.line else '')
+        # the DNA of each csv row (its transfer has the line) is checked per tube in check_rows, with a friendlier message; the
+        # rest of Step 1 - premix parts and dilutions, which no row stands for - is checked here
+        csv_DNA = command.step == 'DNA transfer' and command.line is not None
+        if command.volume < pipette_min and not csv_DNA and command.line not in unreadable:
+            errors.append(where + ': ' + str(round(command.volume, 2)) + ' uL is below the ' + str(pipette_min) + ' uL pipette minimum')
+        # DNA pipetted under the rated minimum is too far off for the transfection; the master mixes only warn
+        rated_min = pipette_specs[command.pipette]['min_volume']
+        if pipette_min <= command.volume < rated_min and command.step == 'DNA transfer':
+            errors.append(where + ': ' + str(round(command.volume, 2)) + ' uL of DNA is below the ' + str(rated_min) + ' uL ' + command.pipette + ' rated minimum, as no smaller pipette is mounted')
+        elif pipette_min <= command.volume < rated_min:
+            below_minimum.setdefault(command.pipette, []).append(command)
+        max_volume = pipette_specs[command.pipette]['max_volume']
+        if command.volume > max_volume:
+            warnings.append(where + ': ' + str(round(command.volume, 1)) + ' uL is over the ' + str(max_volume) + ' uL ' + command.pipette + ' capacity and will be split into ' + str(math.ceil(command.volume / max_volume)) + ' aspirations, each with its own tip and blowout')
+    for pipette, below in below_minimum.items():
+        warnings.append(str(len(below)) + ' transfer(s) are below the ' + str(pipette_specs[pipette]['min_volume']) + ' uL ' + pipette + ' rated minimum, as no smaller pipette is mounted (' +
+            str(round(min(command.volume for command in below), 1)) + ' uL at the least): ' + ', '.join(command.label for command in below[:3]) + (', ...' if len(below) > 3 else ''))
+
+    for location in set(tube_in) | set(tube_out):
+        # what goes in, or what has to be loaded to cover what comes out
+        needed = max(tube_in.get(location, 0), tube_out.get(location, 0) - tube_in.get(location, 0))
+        if needed > tube_capacity:
+            errors.append(names.get(location, location[0] + ' ' + location[1]) + ' needs ' + str(round(needed)) + ' uL, more than a ' + str(tube_capacity) + ' uL tube holds')
+
+    if plan.deck.bulk_source:
+        model, _, capacity = bulk_models[plan.deck.bulk_source]
+        needed = sum(volume for command in commands for source, _, volume in moves(command) if source[0] == 'bulk')
+        if needed > capacity:
+            errors.append('the Opti-MEM ' + plan.deck.bulk_source + ' needs ' + str(round(needed)) + ' uL, more than its ' + str(capacity) + ' uL holds (' + model + ')')
+
+
+def validate_plan(plan):
+    errors = list(plan.errors)
+    warnings = []
+    deck = plan.deck
+    if deck.reagent_rack_slot is not None:
+        warnings.append('the csv leaves too few free tube positions for the reagents, so an extra tube rack for them is loaded in slot ' + deck.reagent_rack_slot)
+    check_rows(plan, deck, errors)
+    check_commands(plan, plan.commands, errors, warnings)
+    return errors, warnings
@@ -0,0 +1,38 @@
+from ot2_transfection import Settings
+from ot2_transfection.commands import Transfer, Distribute, distribute_fills
+from ot2_transfection.deck import pipette_specs
+from ot2_transfection.protocol import plan_run
+from ot2_transfection.validate import check_commands
+
+header = 'DNA source,DNA destination,L3K/OM MM destination,Plate destination,Transfection type,Contents,Concentration (ng/uL),DNA wanted (ng)\n'
+
+
+def DNA_commands(plan):
+    return [command for command in plan.commands if command.step == 'DNA transfer' and isinstance(command, (Transfer, Distribute))]
+
+
+# two 19.5 uL draws from one source: either would go over the p20 with the 1 uL disposal volume, so neither is multi-dispensed
+def test_near_capacity_draws_are_not_multi_dispensed():
+    csv_raw = header + 'A1.1,B1.1,C1.1,A1.1,Single,mNG,10,162.5\nA1.1,B2.1,C2.1,A2.1,Single,mNG,10,162.5\n'
+    plan = plan_run(csv_raw, Settings(multi_dispense_DNA=True))
+    assert plan.errors == []
+    commands = DNA_commands(plan)
+    assert [(type(command), command.pipette, command.volume) for command in commands] == [(Transfer, 'p20', 19.5), (Transfer, 'p20', 19.5)]
+
+
+def test_small_draws_are_still_multi_dispensed():
+    csv_raw = header + 'A1.1,B1.1,C1.1,A1.1,Single,mNG,100,500\nA1.1,B2.1,C2.1,A2.1,Single,mNG,100,500\n'
+    plan = plan_run(csv_raw, Settings(multi_dispense_DNA=True))
+    assert plan.errors == []
+    (command,) = DNA_commands(plan)
+    assert isinstance(command, Distribute)
+    for fill in distribute_fills(command):
+        assert sum(volume for _, volume in fill) + command.disposal <= pipette_specs[command.pipette]['max_volume']
+
+
+def test_overfull_distribute_fill_is_an_error():
+    plan = plan_run(header + 'A1.1,B1.1,C1.1,A1.1,Single,mNG,100,500\n')
+    command = Distribute('DNA transfer', 'DNA A1.1 -> B1.1, B2.1', 'p20', ('tuberack1', 'A1'), [(('tuberack1', 'B1'), 19.5), (('tuberack1', 'B2'), 19.5)], disposal=1, line=2)
+    errors, warnings = [], []
+    check_commands(plan, [command], errors, warnings)
+    assert any('over the 20 uL p20 capacity' in error for error in errors)
@@ -0,0 +1,21 @@
+from ot2_transfection.diff import diff_paths
+
+header = 'DNA source,DNA destination,L3K/OM MM destination,Plate destination,Transfection type,Contents,Concentration (ng/uL),DNA wanted (ng)\n'
+rows = ['A1.1,D6.1,D6.2,A1.1,Single,mNG,75,500\n', 'A2.1,A1.2,A1.3,A2.1,Single,mKO2,50,500\n', 'A1.1,A2.2,A2.3,A3.1,Co,mNG,75,250\n', 'A2.1,A2.2,A2.3,A3.1,Co,mKO2,50,250\n']
+
+
+# an edited plate map: one transfection dropped, one given less DNA, one added, and a co-transfection left as it was
+def test_diff_reports_the_transfections_an_edit_touched(tmp_path):
+    old, new = tmp_path / 'old.csv', tmp_path / 'new.csv'
+    old.write_text(header + ''.join(rows))
+    new.write_text(header + rows[1].replace(',500', ',400') + ''.join(rows[2:]) + 'A3.1,B1.2,B2.2,B1.1,Single,new,60,300\n')
+    report = diff_paths(str(old), str(new))
+    assert report['transfections'] == {'changed': ['A1.2', 'B1.2'], 'removed': ['D6.1']}
+
+
+def test_diff_of_the_same_plate_map_changes_nothing(tmp_path):
+    path = tmp_path / 'map.csv'
+    path.write_text(header + ''.join(rows))
+    report = diff_paths(str(path), str(path))
+    assert report['transfections'] == {'changed': [], 'removed': []}
+    assert report['added'] == report['removed'] == report['changed'] == []
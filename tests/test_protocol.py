@@ -0,0 +1,12 @@
+from ot2_transfection import Settings
+from ot2_transfection.protocol import plan_run
+
+header = 'DNA source,DNA destination,L3K/OM MM destination,Plate destination,Transfection type,Contents,Concentration (ng/uL),DNA wanted (ng)\n'
+
+
+# a location without its rack (as in the v2 plate map) is listed with the other problems, not a KeyError from the layout search
+def test_bad_location_with_optimize_layout_lists_errors():
+    csv_raw = header + 'A3,B3,C3,B3,Single,pGW0127,203,500\nA1.1,B1.1,C1.1,A1.1,Single,mNG,100,500\n'
+    plan = plan_run(csv_raw, Settings(optimize_layout=True))
+    assert any('\'A3\' is not a valid location' in error for error in plan.errors)
+    assert any('\'B3\' is not a valid location' in error for error in plan.errors)
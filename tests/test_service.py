@@ -0,0 +1,22 @@
+import ast
+import json
+
+import pytest
+
+from ot2_transfection.service import RequestError, parse_submission, protocol_script
+
+csv_raw = 'DNA source,DNA destination,L3K/OM MM destination,Plate destination,Transfection type,Contents,Concentration (ng/uL),DNA wanted (ng)\nA1.1,B1.1,C1.1,A1.1,Single,mNG,100,500\n'
+
+
+@pytest.mark.parametrize('name', [True, ['a'], {'a': 1}, 3])
+def test_name_that_is_not_a_string_is_rejected(name):
+    with pytest.raises(RequestError) as error:
+        parse_submission(json.dumps({'csv': csv_raw, 'name': name}).encode(), {}, 'application/json')
+    assert error.value.status == 400
+
+
+def test_protocol_script_is_valid_python_for_any_name():
+    name = 'it\'s a "uORF" library\\n'
+    script = protocol_script(csv_raw, {}, name, 'abc')
+    assert ast.literal_eval(next(line for line in script.splitlines() if 'protocolName' in line).split(':', 1)[1].rstrip(',')) == name
+    ast.parse(script)
@@ -0,0 +1,12 @@
+from ot2_transfection.commands import Setting
+from ot2_transfection.deck import Deck
+from ot2_transfection.trace import RunTrace
+
+
+# a resumed run skips the settings before where it resumes; the trace still has to time what follows at their flow rates
+def test_skipped_settings_carry_over_into_the_features():
+    trace = RunTrace(Deck())
+    trace.skipped(Setting('plate addition', 'p300', 'flow_rate.dispense', 42))
+    for estimator in [trace.features.base] + trace.features.units:
+        assert estimator.flow_rates['p300']['dispense'] == 42
+    assert trace.commands == []
@@ -0,0 +1,17 @@
+from ot2_transfection import Settings
+from ot2_transfection.protocol import plan_run
+
+header = 'DNA source,DNA destination,L3K/OM MM destination,Plate destination,Transfection type,Contents,Concentration (ng/uL),DNA wanted (ng)\n'
+
+
+# a p1000 in place of the p20 leaves the p300 with the sub-20 uL draws: an error for the DNA, a warning for P3000 and L3000
+def test_DNA_below_the_rated_minimum_is_an_error():
+    plan = plan_run(header + 'A1.1,B1.1,C1.1,A1.1,Single,mNG,75,500\n', Settings(p1000_mount='left'))
+    assert plan.errors == ['DNA transfer, DNA A1.1 -> B1.1 (line 2): 8.0 uL of DNA is below the 20 uL p300 rated minimum, as no smaller pipette is mounted']
+    assert any('P3000 -> OM/P3K MM' in warning and 'p300 rated minimum' in warning for warning in plan.warnings)
+
+
+def test_master_mix_below_the_rated_minimum_is_a_warning():
+    plan = plan_run(header + 'A1.1,B1.1,C1.1,A1.1,Single,mNG,75,500\n', Settings(p1000_mount='right'))
+    assert plan.errors == []
+    assert any('p1000 rated minimum' in warning for warning in plan.warnings)